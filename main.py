@@ -3,7 +3,8 @@ import pyarrow as pa
 import pandas as pd
 from src.timer import timing_data, time_this, time_many
 from src.classes import IndexFilter
-from src.sumo_utils import get_sumo_client, get_sumo_tables
+from src.sumo_utils import get_sumo_client
+from src.shared_loader import load_shared_table
 
 from src.pyarrow_stat import calc_grouped_statistics_arrow
 from src.polars_stat import calc_grouped_statistics_polars
@@ -102,16 +103,21 @@ if __name__ == "__main__":
     # index_filters = []
     groupby_cols = ["REGION", "ZONE"]
     response_cols = [ "STOIIP_OIL"]
+    cache_dir = ".sumo_cache"
 
     ## GET SUMO DATA
     client = get_sumo_client()
-    arrow_table = get_sumo_tables(
-        client, case_uuid, table_name, iteration_name, as_pandas=False
-    )
-    pandas_table = get_sumo_tables(
-        client, case_uuid, table_name, iteration_name, as_pandas=True
+    shared_table = load_shared_table(
+        client,
+        case_uuid,
+        table_name,
+        iteration_name,
+        response_cols=response_cols,
+        cache_dir=cache_dir,
     )
-    polars_table = pl.from_arrow(arrow_table)
+    arrow_table = shared_table.to_arrow()
+    pandas_table = shared_table.to_pandas()
+    polars_table = shared_table.to_polars()
 
     ## CALCULATIONS
     aggr_pandas_df = grouped_statistics_with_pandas(
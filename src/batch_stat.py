@@ -0,0 +1,123 @@
+import multiprocessing
+import tempfile
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable
+
+import pyarrow as pa
+
+from .classes import IndexFilter
+from .engines import ENGINES, convert_table, result_to_arrow
+from .sumo_utils import get_sumo_client, get_sumo_tables
+
+
+def calc_grouped_statistics_batch(
+    work_units: list[tuple[str, str]],
+    table_name: str,
+    index_filters: list[IndexFilter],
+    groupby_cols: list[str],
+    response_cols: list[str],
+    engine: str = "polars",
+    cache_dir: str | None = None,
+    client_factory: Callable | None = None,
+    max_workers: int | None = None,
+    case_collection_class: type | None = None,
+) -> pa.Table:
+    """
+    Calculate the same grouped statistics for many (case_uuid, iteration_name) work units
+
+    The work units are spread over a process pool. Each worker loads its table and
+    runs the engine, and hands the result back as an Arrow IPC file, so no tables
+    are pickled between processes. The results are returned as one table with
+    CASE and ITERATION columns.
+
+    client_factory must be picklable, e.g. a module level function, and defaults to
+    get_sumo_client. With cache_dir the workers share the on-disk table cache.
+    case_collection_class is passed to the loader, e.g. FakeCaseCollection.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine: {engine}")
+
+    # Spawn, since forking a process that has started the Polars/Arrow thread pools can deadlock
+    mp_context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory(prefix="grouped_statistics_") as result_dir:
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context) as pool:
+            futures = [
+                pool.submit(
+                    run_work_unit,
+                    case_uuid,
+                    iteration_name,
+                    table_name,
+                    index_filters,
+                    groupby_cols,
+                    response_cols,
+                    engine,
+                    cache_dir,
+                    client_factory,
+                    case_collection_class,
+                    result_dir,
+                )
+                for case_uuid, iteration_name in work_units
+            ]
+            result_paths = [future.result() for future in futures]
+
+        result_tables = []
+        for (case_uuid, iteration_name), result_path in zip(work_units, result_paths):
+            result_table = read_result_table(result_path)
+            result_table = result_table.add_column(
+                0, "ITERATION", pa.array([iteration_name] * result_table.num_rows)
+            )
+            result_table = result_table.add_column(
+                0, "CASE", pa.array([case_uuid] * result_table.num_rows)
+            )
+            result_tables.append(result_table)
+
+        return pa.concat_tables(result_tables, promote_options="default")
+
+
+def run_work_unit(
+    case_uuid: str,
+    iteration_name: str,
+    table_name: str,
+    index_filters: list[IndexFilter],
+    groupby_cols: list[str],
+    response_cols: list[str],
+    engine: str,
+    cache_dir: str | None,
+    client_factory: Callable | None,
+    case_collection_class: type | None,
+    result_dir: str,
+) -> str:
+    """Load one table, calculate the statistics and write them to an Arrow IPC file, returning its path"""
+    client = client_factory() if client_factory is not None else get_sumo_client()
+    arrow_table = get_sumo_tables(
+        client,
+        case_uuid,
+        table_name,
+        iteration_name,
+        as_pandas=False,
+        cache_dir=cache_dir,
+        response_cols=response_cols,
+        case_collection_class=case_collection_class,
+    )
+
+    engine_func, input_format = ENGINES[engine]
+    result = engine_func(
+        convert_table(arrow_table, input_format),
+        index_filters=index_filters,
+        groupby_cols=groupby_cols,
+        response_cols=response_cols,
+    )
+    result_table = result_to_arrow(result)
+
+    result_path = Path(result_dir) / f"{uuid.uuid4().hex}.arrow"
+    with pa.ipc.new_file(str(result_path), result_table.schema) as writer:
+        writer.write_table(result_table)
+    return str(result_path)
+
+
+def read_result_table(result_path: str) -> pa.Table:
+    """Read a result table into memory, so it outlives the temporary directory"""
+    with pa.OSFile(result_path, "rb") as source:
+        return pa.ipc.open_file(source).read_all()
@@ -0,0 +1,353 @@
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import pandas as pd
+import polars as pl
+import pyarrow as pa
+
+from .classes import IndexFilter
+from .engines import ENGINES, convert_table
+from .extend_df_util import make_synthetic_volume_table
+from .fake_sumo import FakeCaseCollection, FakeSumoClient
+from .index_columns import dictionary_encode_index_columns
+from .sumo_utils import get_sumo_tables
+from .timer import measure, tracing
+
+DEFAULT_REAL_COUNTS = [100, 1000, 10000]
+
+REPOSITORY_ROOT = Path(__file__).resolve().parent.parent
+
+# Libraries that are slow to import
+HEAVY_MODULES = [
+    "numpy",
+    "pandas",
+    "polars",
+    "pyarrow",
+    "httpx",
+    "sumo.wrapper",
+    "fmu.sumo.explorer",
+]
+
+# Entry point -> the heavy libraries importing it may load. pyarrow imports numpy,
+# and pandas when it is installed.
+IMPORT_ALLOWANCES = {
+    "src.engines": [],
+    "src.dispatch": [],
+    "src.polars_stat": ["polars"],
+    "src.pyarrow_stat": ["pyarrow", "numpy", "pandas"],
+    "src.numpy_stat": ["pyarrow", "numpy", "pandas"],
+    "src.pandas_stat": ["pandas", "numpy", "pyarrow"],
+    "src.pyarrow_and_polars_stat": ["polars", "pyarrow", "numpy", "pandas"],
+    "src.sumo_utils": ["pyarrow", "numpy", "pandas"],
+}
+
+
+@dataclass
+class BenchmarkQuery:
+    name: str
+    index_filters: list[IndexFilter] = field(default_factory=list)
+    groupby_cols: list[str] = field(default_factory=list)
+    response_cols: list[str] = field(default_factory=list)
+
+
+DEFAULT_QUERIES = [
+    BenchmarkQuery("zone_stoiip", [], ["ZONE"], ["STOIIP_OIL"]),
+    BenchmarkQuery(
+        "region_zone_filtered",
+        [
+            IndexFilter("REGION", ["Region_0", "Region_1"]),
+            IndexFilter("ZONE", ["Zone_0", "Zone_2"]),
+        ],
+        ["REGION", "ZONE"],
+        ["STOIIP_OIL"],
+    ),
+    BenchmarkQuery(
+        "all_dims_derived",
+        [],
+        ["REGION", "ZONE", "FACIES"],
+        ["STOIIP_OIL", "SW_OIL", "PORO_OIL"],
+    ),
+]
+
+
+def run_benchmark(
+    real_counts: list[int] = DEFAULT_REAL_COUNTS,
+    queries: list[BenchmarkQuery] = DEFAULT_QUERIES,
+    engines: list[str] | None = None,
+    runs: int = 20,
+    warmup: int = 3,
+) -> list[dict]:
+    """Run every engine over every dataset size and query, and return one result per combination"""
+    engine_names = engines if engines is not None else list(ENGINES)
+    results = []
+    for n_reals in real_counts:
+        # Encoded the same way as the tables from the Sumo loaders
+        arrow_table = dictionary_encode_index_columns(make_synthetic_volume_table(n_reals))
+        for engine_name in engine_names:
+            engine_func, input_format = ENGINES[engine_name]
+            # Conversion is done up front and not part of the timing
+            input_table = convert_table(arrow_table, input_format)
+            for query in queries:
+                timing = measure(
+                    lambda: engine_func(
+                        input_table,
+                        index_filters=query.index_filters,
+                        groupby_cols=query.groupby_cols,
+                        response_cols=query.response_cols,
+                    ),
+                    runs=runs,
+                    warmup=warmup,
+                )
+                results.append(
+                    {
+                        "engine": engine_name,
+                        "query": query.name,
+                        "n_reals": n_reals,
+                        "n_rows": arrow_table.num_rows,
+                        **timing,
+                    }
+                )
+                print(
+                    f"{engine_name:>18} {query.name:>22} {n_reals:>7} reals: "
+                    f"min {timing['min']:.5f}s median {timing['median']:.5f}s "
+                    f"p95 {timing['p95']:.5f}s"
+                )
+    return results
+
+
+def run_loader_benchmark(
+    real_counts: list[int] = DEFAULT_REAL_COUNTS,
+    n_volume_columns: int = 20,
+    latency: float = 0.05,
+    bandwidth: float | None = 100 * 1024**2,
+    runs: int = 5,
+    warmup: int = 1,
+) -> list[dict]:
+    """
+    Time the Sumo loader against the offline fake backend
+
+    Full loads are compared with loads projected to one response column and with
+    loads from a warm on-disk cache.
+    """
+    results = []
+    for n_reals in real_counts:
+        client = FakeSumoClient(
+            n_reals=n_reals,
+            n_volume_columns=n_volume_columns,
+            latency=latency,
+            bandwidth=bandwidth,
+        )
+        with tempfile.TemporaryDirectory(prefix="sumo_cache_") as cache_dir:
+            scenarios = {
+                "full": {},
+                "projected": {"response_cols": ["STOIIP_OIL"]},
+                "cached": {"cache_dir": cache_dir},
+            }
+            for scenario, kwargs in scenarios.items():
+                load = lambda: get_sumo_tables(
+                    client,
+                    "case",
+                    "table",
+                    "iter-0",
+                    as_pandas=False,
+                    case_collection_class=FakeCaseCollection,
+                    **kwargs,
+                )
+                timing = measure(load, runs=runs, warmup=warmup)
+                # Count the requests of a single load
+                client.reset_stats()
+                load()
+                results.append(
+                    {
+                        "engine": "loader",
+                        "query": scenario,
+                        "n_reals": n_reals,
+                        "requests": client.request_count,
+                        "bytes_served": client.bytes_served,
+                        **timing,
+                    }
+                )
+                print(
+                    f"{'loader':>18} {scenario:>22} {n_reals:>7} reals: "
+                    f"median {timing['median']:.5f}s, {client.request_count} requests"
+                )
+    return results
+
+
+def run_import_benchmark(runs: int = 5) -> list[dict]:
+    """
+    Time the import of each entry point in a fresh interpreter, with -X importtime
+
+    Also records the heavy libraries each import loads. Libraries outside the
+    allowance of the entry point are listed as unexpected.
+    """
+    results = []
+    for module, allowed in IMPORT_ALLOWANCES.items():
+        import_times = []
+        for _ in range(runs):
+            import_time, imported = measure_import(module)
+            import_times.append(import_time)
+        unexpected = [name for name in imported if name not in allowed]
+        results.append(
+            {
+                "engine": "import",
+                "query": module,
+                "n_reals": 0,
+                "runs": runs,
+                "min": min(import_times),
+                "median": statistics.median(import_times),
+                "imported": imported,
+                "unexpected": unexpected,
+            }
+        )
+        print(
+            f"{'import':>18} {module:>30}: median {results[-1]['median']:.5f}s, "
+            f"imports {', '.join(imported) or 'no heavy libraries'}"
+        )
+    return results
+
+
+def measure_import(module: str) -> tuple[float, list[str]]:
+    """Return the import time of a module in seconds, and the heavy libraries it loads"""
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPOSITORY_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    import_time = None
+    imported = []
+    # Lines are "import time: self [us] | cumulative | imported package"
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or line.endswith("imported package"):
+            continue
+        _, cumulative, name = line.split("|")
+        name = name.strip()
+        if name in HEAVY_MODULES:
+            imported.append(name)
+        if name == module:
+            import_time = int(cumulative) / 1e6
+    return import_time, sorted(imported)
+
+
+def get_environment() -> dict:
+    """Return the library versions, results are only comparable within the same environment"""
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "pandas": pd.__version__,
+        "polars": pl.__version__,
+        "pyarrow": pa.__version__,
+    }
+
+
+def write_results(results: list[dict], path: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"environment": get_environment(), "results": results}, f, indent=2)
+
+
+def read_results(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["results"]
+
+
+def compare_with_baseline(
+    results: list[dict], baseline: list[dict], max_slowdown: float = 1.2
+) -> list[dict]:
+    """
+    Return the results that are slower than the baseline
+
+    The median is compared, since it is less sensitive to noise than the mean and min
+    """
+    baseline_by_key = {
+        (result["engine"], result["query"], result["n_reals"]): result
+        for result in baseline
+    }
+    regressions = []
+    for result in results:
+        key = (result["engine"], result["query"], result["n_reals"])
+        baseline_result = baseline_by_key.get(key)
+        if baseline_result is None:
+            continue
+        slowdown = result["median"] / baseline_result["median"]
+        if slowdown > max_slowdown:
+            regressions.append(
+                {
+                    "engine": result["engine"],
+                    "query": result["query"],
+                    "n_reals": result["n_reals"],
+                    "baseline_median": baseline_result["median"],
+                    "median": result["median"],
+                    "slowdown": slowdown,
+                }
+            )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the grouped statistics engines")
+    parser.add_argument("--reals", type=int, nargs="+", default=DEFAULT_REAL_COUNTS)
+    parser.add_argument("--engines", nargs="+", choices=list(ENGINES), default=None)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--max-slowdown", type=float, default=1.2)
+    parser.add_argument(
+        "--loader", action="store_true", help="Benchmark the loader on the fake backend"
+    )
+    parser.add_argument(
+        "--imports",
+        action="store_true",
+        help="Benchmark the import times, fail if an entry point imports an unexpected library",
+    )
+    parser.add_argument(
+        "--trace", default=None, help="Write a Chrome trace of the stages to this path"
+    )
+    args = parser.parse_args()
+
+    with tracing(args.trace) if args.trace else nullcontext():
+        if args.imports:
+            benchmark_results = run_import_benchmark(runs=args.runs)
+        elif args.loader:
+            benchmark_results = run_loader_benchmark(
+                real_counts=args.reals, runs=args.runs, warmup=args.warmup
+            )
+        else:
+            benchmark_results = run_benchmark(
+                real_counts=args.reals,
+                engines=args.engines,
+                runs=args.runs,
+                warmup=args.warmup,
+            )
+    write_results(benchmark_results, args.output)
+
+    import_regressions = [
+        result for result in benchmark_results if result.get("unexpected")
+    ]
+    for result in import_regressions:
+        unexpected = ", ".join(result["unexpected"])
+        print(f"IMPORT REGRESSION {result['query']} imports {unexpected}")
+    if import_regressions:
+        sys.exit(1)
+
+    if args.baseline:
+        regressions = compare_with_baseline(
+            benchmark_results, read_results(args.baseline), args.max_slowdown
+        )
+        for regression in regressions:
+            print(
+                f"REGRESSION {regression['engine']} {regression['query']} "
+                f"{regression['n_reals']} reals: {regression['slowdown']:.2f}x slower"
+            )
+        if regressions:
+            sys.exit(1)
@@ -1,7 +1,28 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 
 @dataclass
 class IndexFilter:
+    """
+    Filter on an index column
+
+    Keeps the rows with one of the values, if values is given, and within
+    min_value and max_value (inclusive), if given. The ranges are meant for REAL,
+    e.g. IndexFilter("REAL", min_value=0, max_value=99). With exclude the filter
+    is negated, i.e. the matching rows are dropped.
+    """
+
     name: str
-    values: list[str]
+    values: list | None = None
+    exclude: bool = False
+    min_value: int | None = None
+    max_value: int | None = None
+
+
+@dataclass
+class QuerySpec:
+    """One grouped statistics request, as passed to the calc_grouped_statistics_* functions"""
+
+    index_filters: list[IndexFilter] = field(default_factory=list)
+    groupby_cols: list[str] = field(default_factory=list)
+    response_cols: list[str] = field(default_factory=list)
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+# The engine libraries are imported by the compiled form that uses them, so an
+# engine only imports its own library
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+    import polars as pl
+    import pyarrow as pa
+
+
+@dataclass(frozen=True)
+class DerivedProperty:
+    """
+    A property calculated from the summed volumes as a ratio
+
+    The value is numerator / denominator, or 1 - numerator / denominator if
+    complement is set. The volumes are summed per REAL and group before the ratio
+    is taken, ratios are not additive.
+    """
+
+    name: str
+    numerator: str
+    denominator: str
+    complement: bool = False
+
+    @property
+    def inputs(self) -> list[str]:
+        return [self.numerator, self.denominator]
+
+    def evaluate(self, numerator, denominator):
+        """Evaluate on anything with arithmetic operators, e.g. Polars expressions, NumPy arrays or pandas Series"""
+        ratio = numerator / denominator
+        return 1 - ratio if self.complement else ratio
+
+
+DERIVED_PROPERTIES = {
+    prop.name: prop
+    for prop in [
+        DerivedProperty("SW_OIL", "HCPV_OIL", "PORV_OIL", complement=True),
+        DerivedProperty("PORO_OIL", "PORV_OIL", "BULK_OIL"),
+        DerivedProperty("NTG_OIL", "NET_OIL", "BULK_OIL"),
+        DerivedProperty("BO", "HCPV_OIL", "STOIIP_OIL"),
+        DerivedProperty("SW_GAS", "HCPV_GAS", "PORV_GAS", complement=True),
+        DerivedProperty("PORO_GAS", "PORV_GAS", "BULK_GAS"),
+        DerivedProperty("NTG_GAS", "NET_GAS", "BULK_GAS"),
+        DerivedProperty("BG", "HCPV_GAS", "GIIP_GAS"),
+    ]
+}
+
+
+def get_derived_properties(
+    df_cols: list[str], response_cols: list[str]
+) -> list[DerivedProperty]:
+    """Return the derived properties to calculate for a query, the response columns not in the table whose inputs are"""
+    return [
+        DERIVED_PROPERTIES[col]
+        for col in response_cols
+        if col not in df_cols
+        and col in DERIVED_PROPERTIES
+        and set(DERIVED_PROPERTIES[col].inputs).issubset(df_cols)
+    ]
+
+
+def get_required_volume_columns(
+    df_cols: list[str] | None, response_cols: list[str]
+) -> list[str]:
+    """
+    Return the volume columns needed for the response columns, including the inputs of derived properties
+
+    With df_cols None, e.g. before the table is fetched, all inputs are returned.
+    Otherwise only the columns in df_cols are.
+    """
+    volume_cols = []
+    for col in response_cols:
+        if df_cols is not None and col in df_cols:
+            volume_cols.append(col)
+        elif col in DERIVED_PROPERTIES:
+            volume_cols.extend(DERIVED_PROPERTIES[col].inputs)
+        elif df_cols is None:
+            volume_cols.append(col)
+    if df_cols is not None:
+        volume_cols = [col for col in volume_cols if col in df_cols]
+    return list(dict.fromkeys(volume_cols))
+
+
+## Compiled forms, one per engine
+def get_polars_expressions(df_cols: list[str], response_cols: list[str]) -> list[pl.Expr]:
+    """Return the derived properties as Polars expressions, evaluated together in one with_columns"""
+    import polars as pl
+
+    return [
+        prop.evaluate(pl.col(prop.numerator), pl.col(prop.denominator)).alias(prop.name)
+        for prop in get_derived_properties(df_cols, response_cols)
+    ]
+
+
+def add_properties_arrow(arrow_table: pa.Table, response_cols: list[str]) -> pa.Table:
+    """
+    Append the derived properties to an Arrow table
+
+    Division by zero and other non-finite results give null, since the Arrow
+    aggregations skip nulls but not NaN.
+    """
+    import pyarrow.compute as pc
+
+    for prop in get_derived_properties(arrow_table.column_names, response_cols):
+        values = pc.divide(arrow_table[prop.numerator], arrow_table[prop.denominator])
+        if prop.complement:
+            values = pc.subtract(1, values)
+        values = pc.if_else(pc.is_finite(values), values, None)
+        arrow_table = arrow_table.append_column(prop.name, values)
+    return arrow_table
+
+
+def add_properties_pandas(pandas_df: pd.DataFrame, response_cols: list[str]) -> pd.DataFrame:
+    """Append the derived properties to a pandas DataFrame"""
+    for prop in get_derived_properties(list(pandas_df.columns), response_cols):
+        pandas_df[prop.name] = prop.evaluate(
+            pandas_df[prop.numerator], pandas_df[prop.denominator]
+        )
+    return pandas_df
+
+
+def get_properties_numpy(
+    volume_sums: dict[str, np.ndarray], response_cols: list[str]
+) -> dict[str, np.ndarray]:
+    """Return the derived properties calculated from NumPy arrays of summed volumes"""
+    import numpy as np
+
+    properties = {}
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for prop in get_derived_properties(list(volume_sums), response_cols):
+            properties[prop.name] = prop.evaluate(
+                volume_sums[prop.numerator], volume_sums[prop.denominator]
+            )
+    return properties
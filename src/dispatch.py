@@ -0,0 +1,258 @@
+from __future__ import annotations
+
+import argparse
+import json
+import math
+from functools import lru_cache
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from .classes import IndexFilter
+from .engines import (
+    ENGINES,
+    convert_input,
+    convert_table,
+    get_input_format,
+    normalize_result_columns,
+    result_to_arrow,
+)
+
+# Only the libraries of the table and the selected engine are imported
+if TYPE_CHECKING:
+    import pandas as pd
+    import polars as pl
+    import pyarrow as pa
+
+DEFAULT_CALIBRATION_PATH = Path(__file__).resolve().parent.parent / "engine_calibration.json"
+
+# Used when there is no calibration
+DEFAULT_ENGINES = {"arrow": "polars", "polars": "polars", "pandas": "pandas"}
+
+# The pyarrow engines use tdigest, i.e. approximate p10 and p90
+APPROXIMATE_PERCENTILE_ENGINES = ["arrow", "arrow_parallel"]
+
+# Input formats that an engine input format can be made from without copying the data
+ZERO_COPY_INPUT_FORMATS = {
+    "arrow": ["arrow", "polars"],
+    "polars": ["arrow", "polars"],
+    "pandas": ["pandas"],
+}
+
+
+def calc_grouped_statistics(
+    table: pa.Table | pl.DataFrame | pd.DataFrame,
+    index_filters: list[IndexFilter],
+    groupby_cols: list[str],
+    response_cols: list[str],
+    engine: str | None = None,
+    exact_percentiles: bool = True,
+    calibration_path: str | Path = DEFAULT_CALIBRATION_PATH,
+):
+    """
+    Grouped statistics calculation with the engine chosen automatically
+
+    The engine is selected from the input format, the row count, the group
+    cardinality and whether exact percentiles are needed, using the timings of the
+    calibration run. The result has the columns of the Polars engine, in the same
+    format as the input table.
+    """
+    input_format = get_input_format(table)
+    if engine is None:
+        engine = select_engine(
+            input_format,
+            get_num_rows(table),
+            estimate_group_count(table, groupby_cols),
+            exact_percentiles,
+            load_calibration(str(calibration_path)),
+        )
+
+    engine_func, engine_input_format = ENGINES[engine]
+    result = engine_func(
+        convert_input(table, engine_input_format),
+        index_filters=index_filters,
+        groupby_cols=groupby_cols,
+        response_cols=response_cols,
+    )
+    if input_format == "polars" and get_input_format(result) == "polars":
+        # The Polars engines return the Polars columns already
+        return result
+    result = normalize_result_columns(result_to_arrow(result))
+    return convert_table(result, input_format)
+
+
+def select_engine(
+    input_format: str,
+    n_rows: int,
+    n_groups: int | None,
+    exact_percentiles: bool,
+    calibration: dict,
+) -> str:
+    """Return the fastest engine at the calibration point nearest to the query"""
+    candidates = get_candidate_engines(input_format, exact_percentiles)
+    points = [
+        point
+        for point in calibration.get("points", [])
+        if point["input_format"] == input_format
+    ]
+    if not points:
+        return DEFAULT_ENGINES[input_format]
+
+    def distance(point: dict) -> float:
+        # Compare on log scale, the timings scale roughly with the magnitudes
+        row_distance = math.log10(max(n_rows, 1)) - math.log10(max(point["n_rows"], 1))
+        if n_groups is None or point["n_groups"] is None:
+            return row_distance**2
+        group_distance = math.log10(max(n_groups, 1)) - math.log10(
+            max(point["n_groups"], 1)
+        )
+        return row_distance**2 + group_distance**2
+
+    nearest_point = min(points, key=distance)
+    timings = {
+        engine: median
+        for engine, median in nearest_point["timings"].items()
+        if engine in candidates
+    }
+    if not timings:
+        return DEFAULT_ENGINES[input_format]
+    return min(timings, key=timings.get)
+
+
+def get_candidate_engines(input_format: str, exact_percentiles: bool) -> list[str]:
+    """
+    Return the engines to choose from for an input format
+
+    For Arrow and Polars input only engines that can read it without copying are
+    used. Pandas input has to be converted for any other engine, so the conversion
+    is part of the calibration timings and all engines are candidates.
+    """
+    if input_format == "pandas":
+        candidates = list(ENGINES)
+    else:
+        candidates = [
+            engine
+            for engine in ENGINES
+            if ENGINES.get_input_format(engine) in ZERO_COPY_INPUT_FORMATS[input_format]
+        ]
+    if exact_percentiles:
+        candidates = [
+            engine for engine in candidates if engine not in APPROXIMATE_PERCENTILE_ENGINES
+        ]
+    return candidates
+
+
+def get_num_rows(table: pa.Table | pl.DataFrame | pd.DataFrame) -> int:
+    input_format = get_input_format(table)
+    if input_format == "arrow":
+        return table.num_rows
+    if input_format == "polars":
+        return table.height
+    return len(table)
+
+
+def estimate_group_count(
+    table: pa.Table | pl.DataFrame | pd.DataFrame, groupby_cols: list[str]
+) -> int | None:
+    """
+    Return an upper bound of the number of groups from the category counts
+
+    Only dictionary/categorical columns know their cardinality without a scan,
+    None is returned if any groupby column is a plain column.
+    """
+    # The library of the table is imported already
+    input_format = get_input_format(table)
+    n_groups = 1
+    for col in groupby_cols:
+        n_categories = None
+        if input_format == "arrow":
+            import pyarrow as pa
+
+            column = table[col]
+            if pa.types.is_dictionary(column.type) and column.num_chunks > 0:
+                n_categories = max(len(chunk.dictionary) for chunk in column.chunks)
+        elif input_format == "polars":
+            import polars as pl
+
+            if table[col].dtype == pl.Categorical:
+                n_categories = table[col].cat.get_categories().len()
+        else:
+            import pandas as pd
+
+            if isinstance(table[col].dtype, pd.CategoricalDtype):
+                n_categories = len(table[col].cat.categories)
+        if n_categories is None:
+            return None
+        n_groups *= n_categories
+    return n_groups
+
+
+@lru_cache
+def load_calibration(calibration_path: str) -> dict:
+    """Load the calibration, read once per process"""
+    path = Path(calibration_path)
+    if not path.exists():
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def calibrate(
+    calibration_path: str | Path = DEFAULT_CALIBRATION_PATH,
+    real_counts: list[int] = [10, 100, 1000, 10000],
+    runs: int = 5,
+    warmup: int = 1,
+) -> dict:
+    """
+    Time every candidate engine for every input format and store the timings
+
+    Conversion of the input to the engine input format is included in the timings.
+    """
+    # Calibration runs every engine, the benchmark helpers import all the libraries
+    from .benchmark import DEFAULT_QUERIES, get_environment
+    from .extend_df_util import make_synthetic_volume_table
+    from .index_columns import dictionary_encode_index_columns
+    from .timer import measure
+
+    points = []
+    for n_reals in real_counts:
+        arrow_table = dictionary_encode_index_columns(make_synthetic_volume_table(n_reals))
+        for input_format in ["arrow", "polars", "pandas"]:
+            table = convert_table(arrow_table, input_format)
+            for query in DEFAULT_QUERIES:
+                timings = {}
+                for engine in get_candidate_engines(input_format, exact_percentiles=False):
+                    engine_func, engine_input_format = ENGINES[engine]
+                    timing = measure(
+                        lambda: engine_func(
+                            convert_input(table, engine_input_format),
+                            index_filters=query.index_filters,
+                            groupby_cols=query.groupby_cols,
+                            response_cols=query.response_cols,
+                        ),
+                        runs=runs,
+                        warmup=warmup,
+                    )
+                    timings[engine] = timing["median"]
+                points.append(
+                    {
+                        "input_format": input_format,
+                        "n_rows": get_num_rows(table),
+                        "n_groups": estimate_group_count(table, query.groupby_cols),
+                        "timings": timings,
+                    }
+                )
+
+    calibration = {"environment": get_environment(), "points": points}
+    with open(calibration_path, "w", encoding="utf-8") as f:
+        json.dump(calibration, f, indent=2)
+    load_calibration.cache_clear()
+    return calibration
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate the engine selection")
+    parser.add_argument("--output", default=str(DEFAULT_CALIBRATION_PATH))
+    parser.add_argument("--reals", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    calibrate(args.output, real_counts=args.reals, runs=args.runs)
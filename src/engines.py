@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import importlib
+import sys
+from collections.abc import Mapping
+from typing import TYPE_CHECKING, Callable
+
+if TYPE_CHECKING:
+    import pandas as pd
+    import polars as pl
+    import pyarrow as pa
+
+# Engine name -> (module, function, input format)
+ENGINE_SPECS = {
+    "pandas": ("pandas_stat", "calc_grouped_statistics_pandas", "pandas"),
+    "polars": ("polars_stat", "calc_grouped_statistics_polars", "polars"),
+    "polars_lazy": ("polars_stat", "calc_grouped_statistics_polars_lazy", "polars"),
+    "arrow": ("pyarrow_stat", "calc_grouped_statistics_arrow", "arrow"),
+    "arrow_parallel": ("pyarrow_stat", "calc_grouped_statistics_arrow_parallel", "arrow"),
+    "arrow_and_polars": (
+        "pyarrow_and_polars_stat",
+        "calc_grouped_statistics_arrow_and_polars",
+        "arrow",
+    ),
+    "numpy": ("numpy_stat", "calc_grouped_statistics_numpy", "arrow"),
+}
+
+
+class EngineRegistry(Mapping):
+    """
+    Engine name -> (function, input format)
+
+    The module of an engine is imported when the engine is first looked up, so
+    only the libraries of the engines in use are imported. Listing the engines
+    and their input formats imports nothing.
+    """
+
+    def __getitem__(self, name: str) -> tuple[Callable, str]:
+        module_name, function_name, input_format = ENGINE_SPECS[name]
+        module = importlib.import_module(f".{module_name}", __package__)
+        return getattr(module, function_name), input_format
+
+    def __contains__(self, name) -> bool:
+        return name in ENGINE_SPECS
+
+    def __iter__(self):
+        return iter(ENGINE_SPECS)
+
+    def __len__(self) -> int:
+        return len(ENGINE_SPECS)
+
+    def get_input_format(self, name: str) -> str:
+        return ENGINE_SPECS[name][2]
+
+
+ENGINES = EngineRegistry()
+
+# Input format -> (module, class) of its tables
+TABLE_CLASSES = {
+    "arrow": ("pyarrow", "Table"),
+    "polars": ("polars", "DataFrame"),
+    "pandas": ("pandas", "DataFrame"),
+}
+
+
+def convert_table(arrow_table: pa.Table, input_format: str):
+    """Convert an Arrow table to the input format of an engine"""
+    if input_format == "pandas":
+        return arrow_table.to_pandas()
+    if input_format == "polars":
+        import polars as pl
+
+        return pl.from_arrow(arrow_table)
+    return arrow_table
+
+
+def result_to_arrow(result: pa.Table | pl.DataFrame | pd.DataFrame) -> pa.Table:
+    """Convert the result of any engine to an Arrow table"""
+    input_format = get_input_format(result)
+    if input_format == "polars":
+        return result.to_arrow()
+    if input_format == "pandas":
+        import pyarrow as pa
+
+        return pa.Table.from_pandas(result, preserve_index=False)
+    return result
+
+
+def get_input_format(table) -> str:
+    """Return the input format of a table"""
+    # A table is from a library that is already imported, the others are not imported
+    for input_format, (module_name, class_name) in TABLE_CLASSES.items():
+        module = sys.modules.get(module_name)
+        if module is not None and isinstance(table, getattr(module, class_name)):
+            return input_format
+    raise TypeError(f"Unsupported table type: {type(table)}")
+
+
+def convert_input(table, input_format: str):
+    """Convert a table of any input format to the given input format, without conversion if it already is"""
+    if get_input_format(table) == input_format:
+        return table
+    return convert_table(result_to_arrow(table), input_format)
+
+
+def normalize_result_columns(result: pa.Table) -> pa.Table:
+    """
+    Return the result with the column names of the Polars engine
+
+    The pandas engine names the standard deviation "_std", and the pyarrow engine
+    returns p10 and p90 together in a "_tdigest" list column.
+    """
+    import pyarrow.compute as pc
+
+    for name in list(result.column_names):
+        column = result[name]
+        if name.endswith("_std"):
+            result = result.rename_columns(
+                [f"{col}dev" if col == name else col for col in result.column_names]
+            )
+        elif name.endswith("_tdigest"):
+            response = name.removesuffix("_tdigest")
+            index = result.column_names.index(name)
+            result = result.remove_column(index)
+            result = result.append_column(f"{response}_p10", pc.list_element(column, 0))
+            result = result.append_column(f"{response}_p90", pc.list_element(column, 1))
+    return result
@@ -1,42 +1,197 @@
+from typing import Iterator
+
 import numpy as np
 import pandas as pd
 import polars as pl
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 
+from .index_columns import INDEX_COLUMNS
 from .timer import time_this
 
+SYNTHETIC_VOLUME_COLUMNS = ["BULK_OIL", "NET_OIL", "PORV_OIL", "HCPV_OIL", "STOIIP_OIL"]
+
+# Realizations of the base table used when none is given
+DEFAULT_BASE_REALS = 10
+# Realizations per record batch of a synthetic ensemble
+DEFAULT_REALS_PER_BATCH = 100
+
 # Function to extend the dataframe
 @time_this
 def extend_dataframe_pandas(df: pd.DataFrame, start: int, end: int):
-    # Calculate how many times we need to replicate the original data
-    n_replications = (end - start) // len(df) + 1
+    """Return an ensemble with the realizations start to end, made from the realizations of df"""
+    base_table = pa.Table.from_pandas(df, preserve_index=False)
+    extended_table = pa.Table.from_batches(
+        iter_synthetic_ensemble(base_table, end - start + 1, start=start)
+    )
+    return extended_table.to_pandas()
 
-    # Replicate the dataframe
-    extended_df = pd.concat([df] * n_replications, ignore_index=True)
 
-    # Update the REAL column
-    extended_df["REAL"] = np.tile(np.arange(len(df)), n_replications)
-    extended_df["REAL"] += start
+def extend_dataframe_polars(df: pl.DataFrame, start: int, end: int) -> pl.DataFrame:
+    """Return an ensemble with the realizations start to end, made from the realizations of df"""
+    extended_table = pa.Table.from_batches(
+        iter_synthetic_ensemble(df.to_arrow(), end - start + 1, start=start)
+    )
+    return pl.from_arrow(extended_table)
 
-    # Trim the dataframe to the desired range
-    extended_df = extended_df[extended_df["REAL"] <= end]
 
-    return extended_df
+## Synthetic ensembles
+def iter_synthetic_ensemble(
+    base_table: pa.Table | None,
+    n_reals: int,
+    start: int = 0,
+    reals_per_batch: int = DEFAULT_REALS_PER_BATCH,
+    spread: float = 0.1,
+    seed: int = 0,
+) -> Iterator[pa.RecordBatch]:
+    """
+    Iterate over the record batches of a synthetic ensemble of n_reals realizations
 
+    Every new realization is a copy of the rows of one realization of the base
+    table, taken in turn, labelled REAL start, start + 1, and so on. Its volumes
+    are scaled by a lognormal factor with the given spread, one factor per
+    realization, so the "Totals" rows and the derived properties stay consistent.
+    Only reals_per_batch realizations are in memory at a time. Without a base
+    table, a small synthetic table is used.
+    """
+    if n_reals < 1:
+        raise ValueError(f"An ensemble needs at least one realization, got {n_reals}")
+    if base_table is None:
+        base_table = make_synthetic_volume_table(DEFAULT_BASE_REALS, seed=seed)
+    if not base_table.num_rows:
+        raise ValueError("The base table has no realizations to copy")
+    base_table = base_table.combine_chunks()
+    volume_cols = [
+        field.name
+        for field in base_table.schema
+        if field.name not in INDEX_COLUMNS and pa.types.is_floating(field.type)
+    ]
 
-def extend_dataframe_polars(df: pl.DataFrame, start: int, end: int) -> pl.DataFrame:
-    # Calculate how many times we need to replicate the original data
-    n_replications = (end - start) // len(df) + 1
+    # Row indices of each base realization
+    base_reals = base_table["REAL"].to_numpy()
+    order = np.argsort(base_reals, kind="stable")
+    _, first_rows = np.unique(base_reals[order], return_index=True)
+    template_rows = np.split(order, first_rows[1:])
+
+    rng = np.random.default_rng(seed)
+    real_type = base_table.schema.field("REAL").type
+    for batch_start in range(0, n_reals, reals_per_batch):
+        batch_reals = np.arange(batch_start, min(batch_start + reals_per_batch, n_reals))
+        templates = [template_rows[real % len(template_rows)] for real in batch_reals]
+        rows_per_real = [len(rows) for rows in templates]
+
+        batch = base_table.take(np.concatenate(templates))
+        real_labels = np.repeat(batch_reals + start, rows_per_real)
+        batch = batch.set_column(
+            batch.schema.get_field_index("REAL"),
+            "REAL",
+            pa.array(real_labels).cast(real_type),
+        )
+        factors = pa.array(
+            np.repeat(rng.lognormal(0.0, spread, len(batch_reals)), rows_per_real)
+        )
+        for col in volume_cols:
+            batch = batch.set_column(
+                batch.schema.get_field_index(col),
+                col,
+                pc.multiply(batch[col], factors).cast(batch.schema.field(col).type),
+            )
+        yield from batch.to_batches()
 
-    # Replicate the dataframe
-    extended_df = pl.concat([df] * n_replications)
 
-    # Update the REAL column
-    real_values = np.tile(np.arange(len(df)), n_replications) + start
-    extended_df = extended_df.with_columns(
-        pl.Series("REAL", real_values[: len(extended_df)])
+@time_this
+def write_synthetic_ensemble(
+    path: str,
+    base_table: pa.Table | None,
+    n_reals: int,
+    file_format: str = "parquet",
+    reals_per_batch: int = DEFAULT_REALS_PER_BATCH,
+    spread: float = 0.1,
+    seed: int = 0,
+) -> None:
+    """
+    Write a synthetic ensemble to a Parquet or Arrow IPC file, batch by batch
+
+    See iter_synthetic_ensemble. The whole ensemble is never in memory, so the
+    file can be much larger than the available RAM. Read it back with the batch
+    sources in streaming_stat, or memory-map the IPC file.
+    """
+    if file_format not in ("parquet", "ipc"):
+        raise ValueError(f"Unknown file format {file_format}, use parquet or ipc")
+    if n_reals < 1:
+        raise ValueError(f"An ensemble needs at least one realization, got {n_reals}")
+    batches = iter_synthetic_ensemble(
+        base_table, n_reals, reals_per_batch=reals_per_batch, spread=spread, seed=seed
     )
+    first_batch = next(batches)
+    if file_format == "parquet":
+        writer = pq.ParquetWriter(str(path), first_batch.schema)
+    else:
+        writer = pa.ipc.new_file(str(path), first_batch.schema)
+    with writer:
+        writer.write_batch(first_batch)
+        for batch in batches:
+            writer.write_batch(batch)
+
 
-    # Trim the dataframe to the desired range
-    extended_df = extended_df.filter(pl.col("REAL") <= end)
+def make_synthetic_volume_table(
+    n_reals: int,
+    n_zones: int = 5,
+    n_regions: int = 5,
+    n_facies: int = 3,
+    seed: int = 0,
+    n_extra_volume_columns: int = 0,
+) -> pa.Table:
+    """
+    Make a synthetic inplace volume table with the same layout as the Sumo tables
 
-    return extended_df
+    One row per REAL/ZONE/REGION/FACIES combination, and one "Totals" row per REAL.
+    n_extra_volume_columns adds VOLUME_<i> columns to make wider tables.
+    """
+    rng = np.random.default_rng(seed)
+    zone_names = np.array([f"Zone_{i}" for i in range(n_zones)] + ["Totals"])
+    region_names = np.array([f"Region_{i}" for i in range(n_regions)] + ["Totals"])
+    facies_names = np.array([f"Facies_{i}" for i in range(n_facies)] + ["Totals"])
+
+    real, zone, region, facies = (
+        index.ravel()
+        for index in np.meshgrid(
+            np.arange(n_reals),
+            np.arange(n_zones),
+            np.arange(n_regions),
+            np.arange(n_facies),
+            indexing="ij",
+        )
+    )
+    n_rows = real.size
+
+    # Chain the volumes so the derived properties are physical
+    volumes = {"BULK_OIL": rng.uniform(1e6, 1e7, n_rows)}
+    volumes["NET_OIL"] = volumes["BULK_OIL"] * rng.uniform(0.5, 1.0, n_rows)
+    volumes["PORV_OIL"] = volumes["NET_OIL"] * rng.uniform(0.1, 0.35, n_rows)
+    volumes["HCPV_OIL"] = volumes["PORV_OIL"] * rng.uniform(0.2, 0.9, n_rows)
+    volumes["STOIIP_OIL"] = volumes["HCPV_OIL"] / rng.uniform(1.1, 1.5, n_rows)
+    for i in range(n_extra_volume_columns):
+        volumes[f"VOLUME_{i}"] = rng.uniform(1e5, 1e6, n_rows)
+
+    # Add the totals per REAL
+    totals_real = np.arange(n_reals)
+    real = np.concatenate([real, totals_real])
+    zone = np.concatenate([zone, np.full(n_reals, n_zones)])
+    region = np.concatenate([region, np.full(n_reals, n_regions)])
+    facies = np.concatenate([facies, np.full(n_reals, n_facies)])
+    for name, values in volumes.items():
+        totals = np.bincount(real[:n_rows], weights=values, minlength=n_reals)
+        volumes[name] = np.concatenate([values, totals])
+
+    return pa.table(
+        {
+            "REAL": pa.array(real, pa.int64()),
+            "ZONE": pa.array(zone_names[zone]),
+            "REGION": pa.array(region_names[region]),
+            "FACIES": pa.array(facies_names[facies]),
+            "GRID": pa.array(np.full(real.size, "Geogrid")),
+            **{name: pa.array(values) for name, values in volumes.items()},
+        }
+    )
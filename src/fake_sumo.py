@@ -0,0 +1,212 @@
+import asyncio
+import hashlib
+import threading
+import uuid
+
+import pyarrow as pa
+
+from .extend_df_util import SYNTHETIC_VOLUME_COLUMNS, make_synthetic_volume_table
+from .index_columns import INDEX_COLUMNS
+
+
+class FakeSumoClient:
+    """
+    Offline stand-in for SumoClient, serving synthetic inplace volume tables
+
+    Every case, iteration and table name gets its own synthetic table, made the
+    same way on every call, and served as one table object per volume column like
+    the Sumo collections. Each request sleeps latency seconds plus the blob size
+    divided by bandwidth (bytes per second). The requests are counted, so caching,
+    concurrency limits and column projection in the loaders can be measured
+    without a network.
+
+    Pass the client to the loaders in place of a SumoClient, with
+    case_collection_class=FakeCaseCollection.
+    """
+
+    def __init__(
+        self,
+        n_reals: int = 100,
+        n_zones: int = 5,
+        n_regions: int = 5,
+        n_facies: int = 3,
+        n_volume_columns: int = len(SYNTHETIC_VOLUME_COLUMNS),
+        latency: float = 0.0,
+        bandwidth: float | None = None,
+        version: int = 0,
+    ):
+        self.n_reals = n_reals
+        self.n_zones = n_zones
+        self.n_regions = n_regions
+        self.n_facies = n_facies
+        self.n_volume_columns = n_volume_columns
+        self.latency = latency
+        self.bandwidth = bandwidth
+        # Part of the blob checksums, a new version looks like changed objects in Sumo
+        self.version = version
+
+        self.request_count = 0
+        self.bytes_served = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._tables: dict[tuple, list["FakeTable"]] = {}
+        self._lock = threading.Lock()
+
+    def get_volume_tables(
+        self, case_uuid: str, iteration_name: str, table_name: str
+    ) -> list["FakeTable"]:
+        """Return the table objects of a case, one per volume column"""
+        key = (case_uuid, iteration_name, table_name)
+        with self._lock:
+            if key not in self._tables:
+                self._tables[key] = self._make_volume_tables(*key)
+            return self._tables[key]
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.request_count = 0
+            self.bytes_served = 0
+            self.max_in_flight = 0
+
+    async def download(self, blob: bytes) -> bytes:
+        """Simulate a blob download with the latency and bandwidth of the client"""
+        with self._lock:
+            self.request_count += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            delay = self.latency
+            if self.bandwidth is not None:
+                delay += len(blob) / self.bandwidth
+            if delay > 0:
+                await asyncio.sleep(delay)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.bytes_served += len(blob)
+        return blob
+
+    def _make_volume_tables(
+        self, case_uuid: str, iteration_name: str, table_name: str
+    ) -> list["FakeTable"]:
+        table_key = f"{case_uuid}/{iteration_name}/{table_name}"
+        seed = int(hashlib.sha256(table_key.encode()).hexdigest()[:8], 16)
+        n_extra_volume_columns = max(
+            self.n_volume_columns - len(SYNTHETIC_VOLUME_COLUMNS), 0
+        )
+        arrow_table = make_synthetic_volume_table(
+            self.n_reals,
+            n_zones=self.n_zones,
+            n_regions=self.n_regions,
+            n_facies=self.n_facies,
+            seed=seed,
+            n_extra_volume_columns=n_extra_volume_columns,
+        )
+        volume_names = [
+            col for col in arrow_table.column_names if col not in INDEX_COLUMNS + ["GRID"]
+        ][: self.n_volume_columns]
+
+        vol_tables = []
+        for volume_name in volume_names:
+            column_table = arrow_table.select(INDEX_COLUMNS + ["GRID", volume_name])
+            vol_tables.append(
+                FakeTable(
+                    self,
+                    str(uuid.uuid5(uuid.NAMESPACE_URL, f"{table_key}/{volume_name}")),
+                    table_name,
+                    iteration_name,
+                    column_table,
+                )
+            )
+        return vol_tables
+
+
+class FakeTable:
+    """Stand-in for a Sumo table object, the table is stored as an Arrow IPC blob"""
+
+    def __init__(
+        self,
+        client: FakeSumoClient,
+        object_uuid: str,
+        name: str,
+        iteration_name: str,
+        arrow_table: pa.Table,
+    ):
+        self._client = client
+        self.uuid = object_uuid
+        self.name = name
+        self.iteration_name = iteration_name
+        self.columns = arrow_table.column_names
+
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, arrow_table.schema) as writer:
+            writer.write_table(arrow_table)
+        self._blob = sink.getvalue().to_pybytes()
+
+        blob_md5 = hashlib.md5(self._blob + str(client.version).encode()).hexdigest()
+        self.metadata = {
+            "_sumo": {"blob_md5": blob_md5},
+            "data": {"name": name, "tagname": "vol", "spec": {"columns": self.columns}},
+        }
+
+    async def to_arrow_async(self) -> pa.Table:
+        blob = await self._client.download(self._blob)
+        return pa.ipc.open_stream(blob).read_all()
+
+    async def to_pandas_async(self):
+        arrow_table = await self.to_arrow_async()
+        return arrow_table.to_pandas()
+
+    def to_arrow(self) -> pa.Table:
+        return asyncio.run(self.to_arrow_async())
+
+
+class FakeCaseCollection:
+    """Stand-in for fmu.sumo.explorer CaseCollection"""
+
+    def __init__(self, sumo: FakeSumoClient):
+        self._sumo = sumo
+
+    def filter(self, uuid: str, **kwargs) -> list["FakeCase"]:
+        return [FakeCase(self._sumo, uuid)]
+
+
+class FakeCase:
+    def __init__(self, sumo: FakeSumoClient, case_uuid: str):
+        self._sumo = sumo
+        self.uuid = case_uuid
+
+    @property
+    def tables(self) -> "FakeTableCollection":
+        return FakeTableCollection(self._sumo, self.uuid)
+
+
+class FakeTableCollection:
+    """Stand-in for a TableCollection, supports the filters used by the loaders"""
+
+    def __init__(self, sumo: FakeSumoClient, case_uuid: str):
+        self._sumo = sumo
+        self._case_uuid = case_uuid
+
+    def filter(
+        self,
+        name: str | None = None,
+        iteration: str | list[str] | None = None,
+        column: str | list[str] | None = None,
+        **kwargs,
+    ) -> list[FakeTable]:
+        iterations = [iteration] if isinstance(iteration, str) else iteration
+        columns = [column] if isinstance(column, str) else column
+        if name is None or iterations is None:
+            raise ValueError("The fake backend needs a table name and an iteration")
+
+        vol_tables = []
+        for iteration_name in iterations:
+            vol_tables.extend(
+                self._sumo.get_volume_tables(self._case_uuid, iteration_name, name)
+            )
+        if columns is not None:
+            vol_tables = [
+                table for table in vol_tables if set(table.columns).intersection(columns)
+            ]
+        return vol_tables
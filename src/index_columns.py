@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+from .classes import IndexFilter
+
+INDEX_COLUMNS = ["REAL", "ZONE", "REGION", "FACIES"]
+
+# Low-cardinality string index columns, stored as dictionary/categorical columns
+CATEGORICAL_INDEX_COLUMNS = ["ZONE", "REGION", "FACIES"]
+
+
+def dictionary_encode_index_columns(arrow_table: pa.Table) -> pa.Table:
+    """
+    Dictionary encode the ZONE, REGION and FACIES columns
+
+    The dictionaries are unified across chunks, so the integer codes mean the same
+    in every chunk and values only need to be resolved to codes once per column.
+    """
+    for name in CATEGORICAL_INDEX_COLUMNS:
+        if name not in arrow_table.column_names:
+            continue
+        column_index = arrow_table.schema.get_field_index(name)
+        if not pa.types.is_dictionary(arrow_table.schema.field(name).type):
+            arrow_table = arrow_table.set_column(
+                column_index, name, pc.dictionary_encode(arrow_table[name])
+            )
+    return arrow_table.unify_dictionaries()
+
+
+def categorize_index_columns(pandas_df: pd.DataFrame) -> pd.DataFrame:
+    """Convert the ZONE, REGION and FACIES columns to categoricals"""
+    categorical_cols = [
+        col for col in CATEGORICAL_INDEX_COLUMNS if col in pandas_df.columns
+    ]
+    return pandas_df.astype({col: "category" for col in categorical_cols})
+
+
+def is_in_arrow(
+    column: pa.ChunkedArray | pa.Array, values: list
+) -> pa.ChunkedArray | pa.Array:
+    """
+    Return the mask of the rows where the column is one of the values
+
+    For dictionary columns the values are resolved to codes once, and the
+    comparison is done on the integer codes instead of the strings.
+    """
+    if not pa.types.is_dictionary(column.type):
+        return pc.is_in(column, value_set=pa.array(values, type=column.type))
+
+    codes = get_dictionary_codes(column, values)
+    return pc.is_in(get_dictionary_indices(column), value_set=codes)
+
+
+def not_equal_arrow(column: pa.ChunkedArray, value) -> pa.ChunkedArray:
+    """Return the mask of the rows where the column is not the value"""
+    if not pa.types.is_dictionary(column.type):
+        return pc.not_equal(column, pa.scalar(value, type=column.type))
+
+    codes = get_dictionary_codes(column, [value])
+    if len(codes) == 0:
+        return pc.is_valid(get_dictionary_indices(column))
+    return pc.not_equal(get_dictionary_indices(column), codes[0])
+
+
+def get_index_mask_arrow(
+    arrow_table: pa.Table,
+    index_filters: list[IndexFilter],
+    exclude_totals: bool = True,
+) -> pa.ChunkedArray | None:
+    """
+    Return one mask for the "Totals" cleanup and all index filters
+
+    The table can then be filtered once, instead of being copied by every filter.
+    None is returned if there is nothing to filter on.
+    """
+    masks = []
+    if exclude_totals:
+        masks.extend(
+            not_equal_arrow(arrow_table[name], "Totals")
+            for name in CATEGORICAL_INDEX_COLUMNS
+        )
+    masks.extend(
+        get_filter_mask_arrow(arrow_table[index_filter.name], index_filter)
+        for index_filter in index_filters
+    )
+    if not masks:
+        return None
+    mask = masks[0]
+    for other_mask in masks[1:]:
+        mask = pc.and_(mask, other_mask)
+    return mask
+
+
+def get_filter_mask_arrow(
+    column: pa.ChunkedArray | pa.Array, index_filter: IndexFilter
+) -> pa.ChunkedArray | pa.Array:
+    """Return the mask of the rows matching one index filter"""
+    masks = []
+    if index_filter.values is not None:
+        masks.append(is_in_arrow(column, index_filter.values))
+    if index_filter.min_value is not None or index_filter.max_value is not None:
+        if pa.types.is_dictionary(column.type):
+            column = column.cast(column.type.value_type)
+        if index_filter.min_value is not None:
+            masks.append(pc.greater_equal(column, index_filter.min_value))
+        if index_filter.max_value is not None:
+            masks.append(pc.less_equal(column, index_filter.max_value))
+    if not masks:
+        mask = pc.is_valid(column)
+    else:
+        mask = masks[0]
+        for other_mask in masks[1:]:
+            mask = pc.and_(mask, other_mask)
+    if index_filter.exclude:
+        mask = pc.invert(mask)
+    return mask
+
+
+def get_dictionary_codes(column: pa.ChunkedArray, values: list) -> pa.Array:
+    """Return the codes of the values in the (unified) dictionary of the column"""
+    if column.num_chunks == 0:
+        return pa.array([], type=column.type.index_type)
+    dictionary = column.chunk(0).dictionary
+    codes = pc.index_in(pa.array(values, type=dictionary.type), value_set=dictionary)
+    return codes.drop_null().cast(column.type.index_type)
+
+
+def get_dictionary_indices(column: pa.ChunkedArray) -> pa.ChunkedArray:
+    """Return the integer codes of a dictionary column, without copying"""
+    return pa.chunked_array(
+        [chunk.indices for chunk in column.chunks], type=column.type.index_type
+    )
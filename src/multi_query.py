@@ -0,0 +1,117 @@
+import polars as pl
+import pyarrow as pa
+
+from .classes import IndexFilter, QuerySpec
+from .derived_properties import get_required_volume_columns
+from .index_columns import get_index_mask_arrow
+from .per_real_cache import get_filters_key
+from .polars_stat import calc_grouped_statistics_from_per_real_sums
+from .streaming_stat import sum_batch_per_real, sum_per_group
+from .timer import staged
+
+
+@staged
+def calc_grouped_statistics_many(
+    arrow_df: pa.Table,
+    queries: list[QuerySpec],
+    drop_nans: bool = True,
+) -> list[pl.DataFrame]:
+    """
+    Grouped statistics for many queries against the same table, planned together
+
+    The table is scanned once: the "Totals" cleanup and the filters shared by all
+    queries are applied, and the volumes needed by any query are summed per REAL
+    and the union of the groupby and filter columns of all queries. Every query is
+    then answered from these sums, by filtering the summed groups and rolling them
+    up to its own groupby. The sums are additive, and a group has one value of each
+    filter column, so this gives the same result as running the queries one by one.
+
+    Returns one result per query, in order, with the columns of the Polars implementation.
+    """
+    if not queries:
+        return []
+
+    # Filters in every query are applied in the shared scan, the rest per query
+    common_filters = get_common_filters(queries)
+    common_filters_keys = {get_filters_key([f]) for f in common_filters}
+    remaining_filters = [
+        [f for f in query.index_filters if get_filters_key([f]) not in common_filters_keys]
+        for query in queries
+    ]
+
+    # The finest grouping needed by any query
+    shared_cols = list(
+        dict.fromkeys(
+            col
+            for query, filters in zip(queries, remaining_filters)
+            for col in query.groupby_cols + [f.name for f in filters]
+            if col != "REAL"
+        )
+    )
+    volume_cols = list(
+        dict.fromkeys(
+            col
+            for query in queries
+            for col in get_required_volume_columns(arrow_df.column_names, query.response_cols)
+        )
+    )
+
+    # Cleanup bad data, filter on the common filters and sum, in one scan
+    shared_sums = sum_batch_per_real(
+        arrow_df, common_filters, ["REAL"] + shared_cols, volume_cols
+    )
+
+    # Filter the summed groups once per distinct set of remaining filters
+    filtered_sums = {}
+    for filters in remaining_filters:
+        filters_key = get_filters_key(filters)
+        if filters_key not in filtered_sums:
+            mask = get_index_mask_arrow(shared_sums, filters, exclude_totals=False)
+            filtered_sums[filters_key] = (
+                shared_sums.filter(mask) if mask is not None else shared_sums
+            )
+
+    # Roll up to the groupby of each query, the finest groupbys first so the
+    # coarser ones can be rolled up from them instead of from the shared sums
+    per_real_sums = {}
+    query_keys = [
+        (get_filters_key(filters), tuple(query.groupby_cols))
+        for query, filters in zip(queries, remaining_filters)
+    ]
+    for filters_key, groupby_cols in sorted(
+        set(query_keys), key=lambda key: -len(key[1])
+    ):
+        source_cols, source = min(
+            [(tuple(shared_cols), filtered_sums[filters_key])]
+            + [
+                (cols, sums)
+                for (key, cols), sums in per_real_sums.items()
+                if key == filters_key and set(groupby_cols).issubset(cols)
+            ],
+            key=lambda item: item[1].num_rows,
+        )
+        if set(groupby_cols) == set(source_cols):
+            per_real_sums[(filters_key, groupby_cols)] = source
+        else:
+            per_real_sums[(filters_key, groupby_cols)] = sum_per_group(
+                source, ["REAL"] + list(groupby_cols), volume_cols
+            )
+
+    per_real_frames = {key: pl.from_arrow(sums) for key, sums in per_real_sums.items()}
+    return [
+        calc_grouped_statistics_from_per_real_sums(
+            per_real_frames[key], query.groupby_cols, query.response_cols, drop_nans
+        )
+        for query, key in zip(queries, query_keys)
+    ]
+
+
+def get_common_filters(queries: list[QuerySpec]) -> list[IndexFilter]:
+    """Return the index filters that are in every query"""
+    common_keys = set.intersection(
+        *[{get_filters_key([f]) for f in query.index_filters} for query in queries]
+    )
+    common_filters = {}
+    for index_filter in queries[0].index_filters:
+        common_filters.setdefault(get_filters_key([index_filter]), index_filter)
+    return [f for key, f in common_filters.items() if key in common_keys]
@@ -0,0 +1,214 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from .classes import IndexFilter
+from .derived_properties import get_properties_numpy, get_required_volume_columns
+from .index_columns import get_filter_mask_arrow
+from .timer import stage, staged
+
+STATISTICS = ["mean", "stddev", "p10", "p90"]
+
+
+@staged
+def calc_grouped_statistics_numpy(
+    arrow_df: pa.Table,
+    index_filters: list[IndexFilter],
+    groupby_cols: list[str],
+    response_cols: list[str],
+    drop_nans: bool = True,
+) -> pa.Table:
+    """
+    NumPy implementation of grouped statistics calculation
+
+    The index columns are factorized to integer codes, the per REAL and group sums
+    are done with np.bincount and all statistics are calculated for every group in
+    one sorted pass. Returns the same columns as the Polars implementation.
+    """
+    # Factorize the index columns and convert the volumes
+    with stage("cleanup"):
+        arrow_df = arrow_df.unify_dictionaries()
+        codes = {}
+        labels = {}
+        for name in dict.fromkeys(
+            ["REAL", "ZONE", "REGION", "FACIES"]
+            + groupby_cols
+            + [index_filter.name for index_filter in index_filters]
+        ):
+            codes[name], labels[name] = factorize_column(arrow_df[name])
+        volume_cols = get_required_volume_columns(arrow_df.column_names, response_cols)
+        volumes = {
+            col: pc.fill_null(arrow_df[col], 0).to_numpy().astype(np.float64)
+            for col in volume_cols
+        }
+
+    # Cleanup bad data and filter on indexes
+    with stage("index_filter"):
+        mask = get_index_mask(codes, labels, index_filters)
+
+    return calc_statistics_from_codes(
+        codes, labels, mask, volumes, groupby_cols, response_cols, drop_nans
+    )
+
+
+def get_index_mask(
+    codes: dict[str, np.ndarray],
+    labels: dict[str, pa.Array],
+    index_filters: list[IndexFilter],
+    exclude_totals: bool = True,
+) -> np.ndarray:
+    """Return the mask for the "Totals" cleanup and the index filters, evaluated on the codes"""
+    n_rows = len(codes["REAL"])
+    mask = np.ones(n_rows, dtype=bool)
+    if exclude_totals:
+        for name in ["ZONE", "REGION", "FACIES"]:
+            # Null labels are dropped too, as in the Arrow and Polars engines
+            dropped_codes = np.concatenate(
+                [
+                    get_value_codes(labels[name], ["Totals"]),
+                    np.flatnonzero(labels[name].is_null().to_numpy(zero_copy_only=False)),
+                ]
+            )
+            mask &= ~np.isin(codes[name], dropped_codes)
+    for index_filter in index_filters:
+        # Evaluate the filter on the distinct values once, and look it up per row
+        label_mask = get_filter_mask_arrow(labels[index_filter.name], index_filter)
+        label_mask = pc.fill_null(label_mask, False).to_numpy(zero_copy_only=False)
+        mask &= label_mask[codes[index_filter.name]]
+    return mask
+
+
+def calc_statistics_from_codes(
+    codes: dict[str, np.ndarray],
+    labels: dict[str, pa.Array],
+    mask: np.ndarray,
+    volumes: dict[str, np.ndarray],
+    groupby_cols: list[str],
+    response_cols: list[str],
+    drop_nans: bool = True,
+) -> pa.Table:
+    """Sum the volumes of the masked rows per REAL and group, and calculate the statistics"""
+
+    # Combine the groupby codes into one group code, and one cell per REAL and group,
+    # and perform a groupby and sum
+    with stage("per_real_sum"):
+        group_shape = tuple(len(labels[col]) for col in groupby_cols)
+        n_groups = int(np.prod(group_shape))
+        n_reals = len(labels["REAL"])
+        group_code = np.zeros(np.count_nonzero(mask), dtype=np.int64)
+        if groupby_cols:
+            group_code = np.ravel_multi_index(
+                [codes[col][mask] for col in groupby_cols], group_shape
+            )
+        cell_code = codes["REAL"][mask].astype(np.int64) * n_groups + group_code
+        n_cells = n_reals * n_groups
+        present_cells = np.flatnonzero(np.bincount(cell_code, minlength=n_cells))
+        volume_sums = {}
+        for col, values in volumes.items():
+            summed = np.bincount(cell_code, weights=values[mask], minlength=n_cells)
+            volume_sums[col] = summed[present_cells]
+
+    # Calculate some properties
+    with stage("derived_properties"):
+        properties = get_properties_numpy(volume_sums, response_cols)
+        response_values = {**volume_sums, **properties}
+
+    # Calculate statistics
+    with stage("statistics"):
+        cell_group = present_cells % n_groups
+        present_groups = np.unique(cell_group)
+        result = {}
+        group_codes = np.unravel_index(present_groups, group_shape)
+        for col, col_codes in zip(groupby_cols, group_codes):
+            result[col] = labels[col].take(pa.array(col_codes))
+        for col in response_cols:
+            stats = calculate_grouped_statistics(
+                cell_group, response_values[col], n_groups, drop_nans
+            )
+            # Undefined statistics are null, as in Polars, while NaN from the data is kept
+            counts = stats["count"][present_groups]
+            for stat in STATISTICS:
+                min_count = 2 if stat == "stddev" else 1
+                result[f"{col}_{stat}"] = pa.array(
+                    stats[stat][present_groups], mask=counts < min_count
+                )
+    return pa.table(result)
+
+
+def calculate_grouped_statistics(
+    group: np.ndarray, values: np.ndarray, n_groups: int, drop_nans: bool = True
+) -> dict[str, np.ndarray]:
+    """
+    Return the count, mean, stddev, p10 and p90 of the values for every group
+
+    The values are sorted once by group and value, and the percentiles are read from
+    the sorted segments with linear interpolation. Groups without values, or with a
+    single value for stddev, get NaN.
+    """
+    if drop_nans:
+        valid = ~np.isnan(values)
+        group = group[valid]
+        values = values[valid]
+
+    counts = np.bincount(group, minlength=n_groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.bincount(group, weights=values, minlength=n_groups) / counts
+        squared_deviation = (values - mean[group]) ** 2
+        variance = np.bincount(group, weights=squared_deviation, minlength=n_groups) / (
+            counts - 1
+        )
+    variance[counts < 2] = np.nan
+
+    # Sort by value, then stable sort by group, faster than np.lexsort
+    order = np.argsort(values)
+    order = order[np.argsort(group[order], kind="stable")]
+    sorted_values = values[order]
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    stats = {"count": counts, "mean": mean, "stddev": np.sqrt(variance)}
+    for stat, quantile in [("p10", 0.1), ("p90", 0.9)]:
+        stats[stat] = get_sorted_segment_quantiles(sorted_values, starts, counts, quantile)
+    return stats
+
+
+def get_sorted_segment_quantiles(
+    sorted_values: np.ndarray, starts: np.ndarray, counts: np.ndarray, quantile: float
+) -> np.ndarray:
+    """Return the linear interpolated quantile of each sorted segment, NaN for empty segments"""
+    result = np.full(len(counts), np.nan)
+    has_values = counts > 0
+    position = quantile * (counts[has_values] - 1)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.ceil(position).astype(np.int64)
+    segment_start = starts[has_values]
+    lower_values = sorted_values[segment_start + lower]
+    upper_values = sorted_values[segment_start + upper]
+    result[has_values] = lower_values + (upper_values - lower_values) * (position - lower)
+    return result
+
+
+def factorize_column(column: pa.ChunkedArray) -> tuple[np.ndarray, pa.Array]:
+    """
+    Return the integer codes and the distinct values of a column
+
+    Null values get the code of a null value appended to the distinct values.
+    """
+    if not pa.types.is_dictionary(column.type):
+        column = pa.chunked_array([pc.dictionary_encode(column.combine_chunks())])
+    # The dictionaries are unified, so the codes are the same in all chunks
+    if column.num_chunks == 0:
+        return np.array([], dtype=np.int32), pa.array([], type=column.type.value_type)
+    dictionary = column.chunk(0).dictionary
+    indices = pa.chunked_array(
+        [chunk.indices for chunk in column.chunks], type=column.type.index_type
+    )
+    if indices.null_count:
+        indices = pc.fill_null(indices, len(dictionary))
+        dictionary = pa.concat_arrays([dictionary, pa.nulls(1, dictionary.type)])
+    return indices.to_numpy(), dictionary
+
+
+def get_value_codes(dictionary: pa.Array, values: list) -> np.ndarray:
+    """Return the codes of the values in the dictionary, values not in the dictionary are ignored"""
+    codes = pc.index_in(pa.array(values, type=dictionary.type), value_set=dictionary)
+    return codes.drop_null().to_numpy()
@@ -1,9 +1,13 @@
 import numpy as np
 import pandas as pd
+import pyarrow as pa
 
 from .classes import IndexFilter
+from .derived_properties import add_properties_pandas
+from .timer import stage, staged
 
 
+@staged
 def calc_grouped_statistics_pandas(
     pandas_df: pd.DataFrame,
     index_filters: list[IndexFilter],
@@ -12,49 +16,33 @@ def calc_grouped_statistics_pandas(
 ) -> pd.DataFrame:
     """Pandas implementation of the grouped mean calculation"""
 
-    # Cleanup bad data
-    pandas_df = pandas_df.drop(columns=["GRID"])[
-        (pandas_df["ZONE"] != "Totals")
-        & (pandas_df["REGION"] != "Totals")
-        & (pandas_df["FACIES"] != "Totals")
-    ]
-
-    # Filter
-    mask = pd.Series(True, index=pandas_df.index)
-    for filter in index_filters:
-        mask &= pandas_df[filter.name].isin(filter.values)
-    pandas_df = pandas_df[mask]
+    # Cleanup bad data and filter, with one mask so the frame is copied once
+    with stage("index_filter"):
+        mask = get_index_mask_pandas(pandas_df, index_filters)
+        pandas_df = pandas_df.loc[mask, pandas_df.columns.drop("GRID")]
+        pandas_df = categorize_arrow_dictionary_columns(pandas_df, groupby_cols)
 
     # Perform a groupby and sum
-    per_group_with_real = ["REAL"] + groupby_cols
-    per_group_summed = pandas_df.groupby(per_group_with_real).sum()
+    with stage("per_real_sum"):
+        per_group_with_real = ["REAL"] + groupby_cols
+        per_group_summed = pandas_df.groupby(per_group_with_real, observed=True).sum(
+            numeric_only=True
+        )
 
     # Calculate some properties
-    if (
-        "HCPV_OIL" in pandas_df.columns
-        and "PORV_OIL" in pandas_df.columns
-        and "SW_OIL" in response_cols
-    ):
-        per_group_summed["SW_OIL"] = 1 - (
-            per_group_summed["HCPV_OIL"] / per_group_summed["PORV_OIL"]
-        )
-    if (
-        "PORV_OIL" in pandas_df.columns
-        and "BULK_OIL" in pandas_df.columns
-        and "PORO_OIL" in response_cols
-    ):
-        per_group_summed["PORO_OIL"] = (
-            per_group_summed["PORV_OIL"] / per_group_summed["BULK_OIL"]
-        )
+    with stage("derived_properties"):
+        per_group_summed = add_properties_pandas(per_group_summed, response_cols)
 
     numerical_columns = per_group_summed.select_dtypes(include=[np.number]).columns
     numerical_columns = [col for col in numerical_columns if col in response_cols]
 
     # Calculate statistics
-
-    per_group_summed_mean = per_group_summed.groupby(groupby_cols)[
-        numerical_columns
-    ].agg([np.mean, np.std, p10, p90])
+    with stage("statistics"):
+        # As NumPy floats, NaN properties are skipped also from ArrowDtype columns
+        per_group_summed = per_group_summed[numerical_columns].astype(np.float64)
+        per_group_summed_mean = per_group_summed.groupby(groupby_cols, observed=True)[
+            numerical_columns
+        ].agg([np.mean, np.std, p10, p90])
 
     # Combine multi-index columns
     per_group_summed_mean.reset_index(inplace=True)
@@ -70,9 +58,56 @@ def calc_grouped_statistics_pandas(
     return per_group_summed_mean
 
 
+def get_index_mask_pandas(
+    pandas_df: pd.DataFrame, index_filters: list[IndexFilter]
+) -> pd.Series:
+    """
+    Return one mask for the "Totals" cleanup and all index filters
+
+    Rows with a null ZONE, REGION or FACIES, or a null in a filtered column, are
+    dropped, also by excluding filters, as in the Arrow and Polars engines.
+    """
+    mask = pd.Series(True, index=pandas_df.index)
+    for name in ["ZONE", "REGION", "FACIES"]:
+        column = pandas_df[name]
+        mask &= column.notna() & (column != "Totals")
+    for index_filter in index_filters:
+        column = pandas_df[index_filter.name]
+        filter_mask = pd.Series(True, index=pandas_df.index)
+        if index_filter.values is not None:
+            filter_mask &= column.isin(index_filter.values)
+        if index_filter.min_value is not None:
+            filter_mask &= column >= index_filter.min_value
+        if index_filter.max_value is not None:
+            filter_mask &= column <= index_filter.max_value
+        mask &= column.notna() & (~filter_mask if index_filter.exclude else filter_mask)
+    return mask.fillna(False).astype(bool)
+
+
+def categorize_arrow_dictionary_columns(
+    pandas_df: pd.DataFrame, cols: list[str]
+) -> pd.DataFrame:
+    """
+    Convert ArrowDtype dictionary columns to categoricals, e.g. in SharedTable.to_pandas()
+
+    groupby(observed=True) does not drop the unobserved values of an ArrowDtype
+    dictionary key, so the statistics would be called on empty groups.
+    """
+    dictionary_cols = [
+        col
+        for col in cols
+        if isinstance(pandas_df[col].dtype, pd.ArrowDtype)
+        and pa.types.is_dictionary(pandas_df[col].dtype.pyarrow_dtype)
+    ]
+    if not dictionary_cols:
+        return pandas_df
+    return pandas_df.astype({col: "category" for col in dictionary_cols})
+
+
+# NaN properties are skipped, as by mean and std
 def p10(x):
-    return np.quantile(x, 0.1)
+    return np.nanquantile(x, 0.1)
 
 
 def p90(x):
-    return np.quantile(x, 0.9)
+    return np.nanquantile(x, 0.9)
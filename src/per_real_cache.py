@@ -0,0 +1,185 @@
+import threading
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import polars as pl
+import pyarrow as pa
+
+from .classes import IndexFilter
+from .polars_stat import calc_grouped_statistics_from_per_real_sums
+from .pyarrow_stat import get_numerical_column_names
+from .streaming_stat import sum_batch_per_real, sum_per_group
+
+DEFAULT_MAX_ENTRIES = 64
+DEFAULT_MAX_BYTES = 512 * 1024**2
+
+
+@dataclass
+class PerRealSumsEntry:
+    table_id: int
+    filters_key: tuple
+    groupby_cols: tuple[str, ...]
+    per_real_sums: pa.Table
+
+
+class PerRealSumCache:
+    """
+    LRU cache of the volumes summed per REAL and group
+
+    The first stage of every engine, the sum per REAL and group, is the expensive
+    part. The cache keeps that result per input table, index filters and groupby
+    columns, with all volume columns summed so switching response columns is a hit.
+    A coarser groupby is rolled up from a cached finer one instead of rescanning the
+    input table. Entries are evicted on count and on size in bytes.
+    """
+
+    def __init__(
+        self, max_entries: int = DEFAULT_MAX_ENTRIES, max_bytes: int = DEFAULT_MAX_BYTES
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple, PerRealSumsEntry] = OrderedDict()
+        self._nbytes = 0
+        self._tracked_table_ids: set[int] = set()
+        # Reentrant, since the finalizer of a table can run while the lock is held
+        self._lock = threading.RLock()
+
+    def get_per_real_sums(
+        self,
+        arrow_df: pa.Table,
+        index_filters: list[IndexFilter],
+        groupby_cols: list[str],
+    ) -> pa.Table:
+        """Return the volumes summed per REAL and group, from the cache if possible"""
+        table_id = self._get_table_id(arrow_df)
+        filters_key = get_filters_key(index_filters)
+        key = (table_id, filters_key, tuple(groupby_cols))
+        per_group_with_real = ["REAL"] + groupby_cols
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry.per_real_sums
+            finer_entry = self._find_finer_entry(table_id, filters_key, groupby_cols)
+
+        if finer_entry is not None:
+            # Roll up from the finer groupby, the sums are additive
+            finer_sums = finer_entry.per_real_sums
+            volume_cols = [
+                col
+                for col in finer_sums.column_names
+                if col not in ["REAL"] + list(finer_entry.groupby_cols)
+            ]
+            per_real_sums = sum_per_group(finer_sums, per_group_with_real, volume_cols)
+        else:
+            volume_cols = [
+                col for col in get_numerical_column_names(arrow_df) if col != "REAL"
+            ]
+            per_real_sums = sum_batch_per_real(
+                arrow_df, index_filters, per_group_with_real, volume_cols
+            )
+
+        with self._lock:
+            self._insert(
+                key,
+                PerRealSumsEntry(table_id, filters_key, tuple(groupby_cols), per_real_sums),
+            )
+        return per_real_sums
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _find_finer_entry(
+        self, table_id: int, filters_key: tuple, groupby_cols: list[str]
+    ) -> PerRealSumsEntry | None:
+        """Return the smallest cached entry that is grouped on a superset of the columns"""
+        candidates = [
+            entry
+            for entry in self._entries.values()
+            if entry.table_id == table_id
+            and entry.filters_key == filters_key
+            and set(groupby_cols).issubset(entry.groupby_cols)
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda entry: entry.per_real_sums.num_rows)
+
+    def _insert(self, key: tuple, entry: PerRealSumsEntry) -> None:
+        if key in self._entries:
+            return
+        self._entries[key] = entry
+        self._nbytes += entry.per_real_sums.nbytes
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._nbytes > self.max_bytes
+        ):
+            _, evicted = self._entries.popitem(last=False)
+            self._nbytes -= evicted.per_real_sums.nbytes
+
+    def _get_table_id(self, arrow_df: pa.Table) -> int:
+        """
+        Return the identity of the input table
+
+        The entries of a table are dropped when the table is garbage collected, so a
+        new table reusing the same id can not hit stale entries.
+        """
+        table_id = id(arrow_df)
+        with self._lock:
+            if table_id not in self._tracked_table_ids:
+                self._tracked_table_ids.add(table_id)
+                weakref.finalize(arrow_df, self._drop_table, table_id)
+        return table_id
+
+    def _drop_table(self, table_id: int) -> None:
+        with self._lock:
+            self._tracked_table_ids.discard(table_id)
+            for key in [key for key in self._entries if key[0] == table_id]:
+                self._nbytes -= self._entries.pop(key).per_real_sums.nbytes
+
+
+def get_filters_key(index_filters: list[IndexFilter]) -> tuple:
+    """Return a hashable key for the index filters, independent of their order"""
+    filter_keys = [
+        (
+            index_filter.name,
+            (
+                tuple(sorted(map(str, index_filter.values)))
+                if index_filter.values is not None
+                else None
+            ),
+            index_filter.exclude,
+            index_filter.min_value,
+            index_filter.max_value,
+        )
+        for index_filter in index_filters
+    ]
+    return tuple(sorted(filter_keys, key=repr))
+
+
+_default_cache = PerRealSumCache()
+
+
+def calc_grouped_statistics_cached(
+    arrow_df: pa.Table,
+    index_filters: list[IndexFilter],
+    groupby_cols: list[str],
+    response_cols: list[str],
+    drop_nans: bool = True,
+    cache: PerRealSumCache | None = None,
+) -> pl.DataFrame:
+    """Grouped statistics calculation using cached per REAL sums"""
+    cache = cache if cache is not None else _default_cache
+    per_real_sums = cache.get_per_real_sums(arrow_df, index_filters, groupby_cols)
+    return calc_grouped_statistics_from_per_real_sums(
+        pl.from_arrow(per_real_sums), groupby_cols, response_cols, drop_nans
+    )
@@ -1,7 +1,10 @@
 import polars as pl
 from .classes import IndexFilter
+from .derived_properties import get_polars_expressions, get_required_volume_columns
+from .timer import stage, staged
 
 
+@staged
 def calc_grouped_statistics_polars(
     polars_df: pl.DataFrame,
     index_filters: list[IndexFilter],
@@ -12,58 +15,150 @@ def calc_grouped_statistics_polars(
     """Polars implementation of grouped statistics calculation"""
 
     # Cleanup bad data
-    polars_df = polars_df.drop("GRID").filter(
-        (polars_df["ZONE"] != "Totals")
-        & (polars_df["REGION"] != "Totals")
-        & (polars_df["FACIES"] != "Totals")
-    )
+    with stage("cleanup"):
+        polars_df = polars_df.drop("GRID")
 
-    # Filter on indexes
-    filters = []
-    for index_filter in index_filters:
-        filters.append(pl.col(index_filter.name).is_in(index_filter.values))
-    if filters:
-        polars_df = polars_df.filter(pl.all_horizontal(filters))
+    # Filter on indexes and "Totals" in one predicate
+    with stage("index_filter"):
+        polars_df = polars_df.filter(get_index_filter_expression(index_filters))
 
     # Perform a groupby and sum
-    per_group_with_real = ["REAL"] + groupby_cols
-    per_group_summed = polars_df.group_by(per_group_with_real).agg(
-        [pl.sum("*").exclude(per_group_with_real)]
-    )
+    with stage("per_real_sum"):
+        per_group_with_real = ["REAL"] + groupby_cols
+        per_group_summed = polars_df.group_by(per_group_with_real).agg(
+            [pl.sum("*").exclude(per_group_with_real)]
+        )
 
     # Calculate some properties
-    calculated_columns = get_calculated_properties_expression(
-        polars_df.columns, response_cols
-    )
-    if calculated_columns:
-        per_group_summed = per_group_summed.with_columns(calculated_columns)
+    with stage("derived_properties"):
+        calculated_columns = get_polars_expressions(
+            polars_df.columns, response_cols
+        )
+        if calculated_columns:
+            per_group_summed = per_group_summed.with_columns(calculated_columns)
 
     # Define aggregation expressions
-    agg_expressions = get_aggregation_expressions(response_cols, drop_nans)
-
-    # Perform the groupby and aggregation
-    per_group_stats = (
-        per_group_summed.select(*groupby_cols, *response_cols)
-        .group_by(groupby_cols)
-        .agg(agg_expressions)
-    )
+    with stage("statistics"):
+        agg_expressions = get_aggregation_expressions(response_cols, drop_nans)
+
+        # Perform the groupby and aggregation
+        per_group_stats = (
+            per_group_summed.select(*groupby_cols, *response_cols)
+            .group_by(groupby_cols)
+            .agg(agg_expressions)
+        )
 
     return per_group_stats
 
 
+@staged
+def calc_grouped_statistics_from_per_real_sums(
+    per_group_summed: pl.DataFrame,
+    groupby_cols: list[str],
+    response_cols: list[str],
+    drop_nans: bool = True,
+) -> pl.DataFrame:
+    """Calculate the derived properties and the statistics from volumes summed per REAL and group"""
 
-def get_calculated_properties_expression(df_cols: list[str], response_cols: list[str]):
-    """Return the calculated properties expressions."""
-    calculated_columns = []
-    if "HCPV_OIL" in df_cols and "PORV_OIL" in df_cols and "SW_OIL" in response_cols:
-        calculated_columns.append(
-            (1 - (pl.col("HCPV_OIL") / pl.col("PORV_OIL"))).alias("SW_OIL")
+    # Calculate some properties
+    with stage("derived_properties"):
+        calculated_columns = get_polars_expressions(
+            per_group_summed.columns, response_cols
         )
-    if "PORV_OIL" in df_cols and "BULK_OIL" in df_cols and "PORO_OIL" in response_cols:
-        calculated_columns.append(
-            (pl.col("PORV_OIL") / pl.col("BULK_OIL")).alias("PORO_OIL")
+        if calculated_columns:
+            per_group_summed = per_group_summed.with_columns(calculated_columns)
+
+    # Perform the groupby and aggregation
+    with stage("statistics"):
+        agg_expressions = get_aggregation_expressions(response_cols, drop_nans)
+        per_group_stats = (
+            per_group_summed.select(*groupby_cols, *response_cols)
+            .group_by(groupby_cols)
+            .agg(agg_expressions)
         )
-    return calculated_columns
+    return per_group_stats
+
+
+@staged
+def calc_grouped_statistics_polars_lazy(
+    polars_source: pl.LazyFrame | pl.DataFrame | str,
+    index_filters: list[IndexFilter],
+    groupby_cols: list[str],
+    response_cols: list[str],
+    drop_nans: bool = True,
+    streaming: bool = True,
+) -> pl.DataFrame:
+    """
+    Lazy Polars implementation of grouped statistics calculation
+
+    The whole calculation is built as one query plan, so only the needed columns are
+    read, the filters are pushed down to the scan and no intermediate tables are
+    materialized. The source can be a LazyFrame, a DataFrame or the path to a
+    Parquet or Arrow IPC file, e.g. a cached Sumo table.
+    """
+    lazy_df = scan_table(polars_source)
+    df_cols = lazy_df.collect_schema().names()
+
+    # Only read the columns used by the query
+    per_group_with_real = ["REAL"] + groupby_cols
+    volume_cols = get_required_volume_columns(df_cols, response_cols)
+    filter_cols = ["ZONE", "REGION", "FACIES"] + [
+        index_filter.name for index_filter in index_filters
+    ]
+    selected_cols = list(dict.fromkeys(per_group_with_real + filter_cols + volume_cols))
+    lazy_df = lazy_df.select(selected_cols)
+
+    # Cleanup bad data and filter on indexes in one predicate
+    lazy_df = lazy_df.filter(get_index_filter_expression(index_filters))
+
+    # Perform a groupby and sum
+    lazy_df = lazy_df.group_by(per_group_with_real).agg(pl.col(volume_cols).sum())
+
+    # Calculate some properties
+    calculated_columns = get_polars_expressions(df_cols, response_cols)
+    if calculated_columns:
+        lazy_df = lazy_df.with_columns(calculated_columns)
+
+    # Perform the groupby and aggregation
+    agg_expressions = get_aggregation_expressions(response_cols, drop_nans)
+    lazy_df = lazy_df.group_by(groupby_cols).agg(agg_expressions)
+
+    # The whole plan runs here
+    with stage("collect"):
+        return lazy_df.collect(streaming=streaming)
+
+
+def scan_table(polars_source: pl.LazyFrame | pl.DataFrame | str) -> pl.LazyFrame:
+    """Return a LazyFrame for a table or the path to a Parquet or Arrow IPC file"""
+    if isinstance(polars_source, pl.LazyFrame):
+        return polars_source
+    if isinstance(polars_source, pl.DataFrame):
+        return polars_source.lazy()
+    if str(polars_source).endswith(".parquet"):
+        return pl.scan_parquet(polars_source)
+    return pl.scan_ipc(polars_source)
+
+
+def get_index_filter_expression(
+    index_filters: list[IndexFilter], exclude_totals: bool = True
+) -> pl.Expr:
+    """Return one predicate for the "Totals" cleanup and all index filters"""
+    filters = []
+    if exclude_totals:
+        filters.extend(pl.col(name) != "Totals" for name in ["ZONE", "REGION", "FACIES"])
+    for index_filter in index_filters:
+        col = pl.col(index_filter.name)
+        conditions = []
+        if index_filter.values is not None:
+            conditions.append(col.is_in(index_filter.values))
+        if index_filter.min_value is not None:
+            conditions.append(col >= index_filter.min_value)
+        if index_filter.max_value is not None:
+            conditions.append(col <= index_filter.max_value)
+        condition = pl.all_horizontal(conditions) if conditions else col.is_not_null()
+        filters.append(~condition if index_filter.exclude else condition)
+    return pl.all_horizontal(filters) if filters else pl.lit(True)
+
 
 def get_aggregation_expressions(response_cols: list[str], drop_nans: bool = True):
     """Generate the aggregation expressions for the selected statistics."""
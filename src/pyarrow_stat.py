@@ -1,89 +1,188 @@
-import polars as pl
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import pyarrow as pa
 import pyarrow.compute as pc
 
 from .classes import IndexFilter
+from .derived_properties import add_properties_arrow, get_required_volume_columns
+from .index_columns import get_index_mask_arrow
+from .timer import stage, staged
 
 
+@staged
 def calc_grouped_statistics_arrow(
     arrow_df: pa.Table,
     index_filters: list[IndexFilter],
     groupby_cols: list[str],
     response_cols: list[str],
-) -> pl.DataFrame:
-    """Pyarrow implementation of grouped statistics calculation"""
+    max_workers: int = 1,
+) -> pa.Table:
+    """
+    Pyarrow implementation of grouped statistics calculation
 
-    # Cleanup bad data
-    arrow_df = arrow_df.drop(["GRID"])
-    filter_condition = (
-        (pc.field("ZONE") != "Totals")
-        & (pc.field("REGION") != "Totals")
-        & (pc.field("FACIES") != "Totals")
-    )
-    arrow_df = arrow_df.filter(filter_condition)
+    With max_workers above 1, the filter and the sum per REAL are run on a thread
+    pool over REAL ranges, see sum_per_real_parallel.
+    """
 
-    # Filter on indexes
-    mask = pa.array([True] * arrow_df.num_rows)
+    # Cleanup bad data
+    with stage("cleanup"):
+        arrow_df = arrow_df.unify_dictionaries()
+        columns_to_group_by_for_sum = list(dict.fromkeys(["REAL"] + groupby_cols))
+        volume_names = [
+            volume_name
+            for volume_name in get_required_volume_columns(
+                arrow_df.column_names, response_cols
+            )
+            if volume_name not in columns_to_group_by_for_sum
+        ]
 
-    for index_filter in index_filters:
-        identifier_mask = pc.is_in(
-            arrow_df[index_filter.name], value_set=pa.array(index_filter.values)
-        )
-        mask = pc.and_(mask, identifier_mask)
-    arrow_df = arrow_df.filter(mask)
+    # Filter on indexes and "Totals", with one mask so the table is copied once
+    with stage("index_filter"):
+        mask = get_index_mask_arrow(arrow_df, index_filters)
+        arrow_df = arrow_df.select(columns_to_group_by_for_sum + volume_names)
 
     # Perform a groupby and sum
-    columns_to_group_by_for_sum = set(list(groupby_cols) + ["REAL"])
-    accumulated_table = arrow_df.group_by(columns_to_group_by_for_sum).aggregate(
-        [
-            (volume_name, "sum")
-            for volume_name in arrow_df.column_names
-            if volume_name in get_numerical_column_names(arrow_df)
+    with stage("per_real_sum"):
+        if max_workers > 1:
+            accumulated_table = sum_per_real_parallel(
+                arrow_df, mask, columns_to_group_by_for_sum, volume_names, max_workers
+            )
+        else:
+            if mask is not None:
+                arrow_df = arrow_df.filter(mask)
+            accumulated_table = sum_per_real(
+                arrow_df, columns_to_group_by_for_sum, volume_names
+            )
+
+    # Calculate some properties
+    with stage("derived_properties"):
+        accumulated_table = add_properties_arrow(accumulated_table, response_cols)
+
+    # Calculate statistics
+    with stage("statistics"):
+        valid_result_names = [
+            col for col in response_cols if col not in groupby_cols + ["REAL"]
+        ]
+        # The sample standard deviation, as in the other engines
+        stddev_options = pc.VarianceOptions(ddof=1)
+        basic_statistics_aggregations = [
+            aggregation
+            for result_name in valid_result_names
+            for aggregation in [
+                (result_name, "mean"),
+                (result_name, "stddev", stddev_options),
+            ]
+        ]
+        tdigest_options = pc.TDigestOptions([0.1, 0.9])  # p10 and p90
+        percentile_aggregations = [
+            (result_name, "tdigest", tdigest_options) for result_name in valid_result_names
         ]
+        statistical_aggregations = basic_statistics_aggregations + percentile_aggregations
+        table_grouped_by = accumulated_table.group_by(groupby_cols)
+        statistical_table = table_grouped_by.aggregate(statistical_aggregations)
+
+    return statistical_table
+
+
+@staged
+def calc_grouped_statistics_arrow_parallel(
+    arrow_df: pa.Table,
+    index_filters: list[IndexFilter],
+    groupby_cols: list[str],
+    response_cols: list[str],
+    max_workers: int | None = None,
+) -> pa.Table:
+    """Pyarrow implementation with the sum per REAL on all cores, see sum_per_real_parallel"""
+    return calc_grouped_statistics_arrow(
+        arrow_df,
+        index_filters,
+        groupby_cols,
+        response_cols,
+        max_workers=max_workers or os.cpu_count() or 1,
     )
+
+
+def sum_per_real(
+    arrow_df: pa.Table,
+    columns_to_group_by_for_sum: list[str],
+    volume_names: list[str],
+    use_threads: bool = True,
+) -> pa.Table:
+    """Sum the volumes per REAL and group, keeping the original column names"""
+    accumulated_table = arrow_df.group_by(
+        columns_to_group_by_for_sum, use_threads=use_threads
+    ).aggregate([(volume_name, "sum") for volume_name in volume_names])
     suffix_to_remove = "_sum"
     column_names_with_suffix = accumulated_table.column_names
     new_column_names = [
         column_name.replace(suffix_to_remove, "")
         for column_name in column_names_with_suffix
     ]
-    accumulated_table = accumulated_table.rename_columns(new_column_names)
+    return accumulated_table.rename_columns(new_column_names)
 
-    # Calculate some properties
-    if "SW_OIL" in response_cols and set(["HCPV_OIL", "PORV_OIL"]).issubset(
-        accumulated_table.column_names
-    ):
-        sw_array = calculate_property_from_volume_arrays(
-            "SW_OIL", accumulated_table["HCPV_OIL"], accumulated_table["PORV_OIL"]
+
+def sum_per_real_parallel(
+    arrow_df: pa.Table,
+    mask: pa.ChunkedArray | None,
+    columns_to_group_by_for_sum: list[str],
+    volume_names: list[str],
+    max_workers: int,
+) -> pa.Table:
+    """
+    Filter and sum per REAL and group on a thread pool, one partition per REAL range
+
+    The table is partitioned once, so each partition reads only its own rows. A table
+    in REAL order, as loaded, is split into zero-copy slices. Otherwise the rows to
+    keep are grouped by partition with one stable sort, and each partition takes its
+    contiguous range of them. The Arrow compute functions release the GIL, so the
+    partitions run in parallel. REAL is a group key, so no REAL and group is in two
+    partitions, and the partial sums are concatenated without summing again. Each
+    partition is grouped without Arrow's own threads, the pool is the parallelism.
+    """
+    with stage("partition"):
+        rows = None
+        real_column = arrow_df["REAL"]
+        reals = real_column.to_numpy() if not real_column.null_count else None
+        if reals is None or np.any(reals[1:] < reals[:-1]):
+            # Rows with a null REAL are left out, as by a filter on REAL
+            keep = pc.is_valid(real_column)
+            if mask is not None:
+                keep = pc.and_(keep, mask)
+            rows = pc.indices_nonzero(keep)
+            reals = real_column.take(rows).to_numpy()
+        if not len(reals):
+            return sum_per_real(
+                arrow_df.slice(0, 0), columns_to_group_by_for_sum, volume_names
+            )
+        bounds = np.unique(
+            np.linspace(reals.min(), reals.max() + 1, max_workers + 1).astype(np.int64)
         )
-        accumulated_table = accumulated_table.append_column("SW_OIL", sw_array)
-    if "PORO_OIL" in response_cols and set(["BULK_OIL", "PORV_OIL"]).issubset(
-        accumulated_table.column_names
-    ):
-        poro_array = calculate_property_from_volume_arrays(
-            "PORO_OIL", accumulated_table["PORV_OIL"], accumulated_table["BULK_OIL"]
+        if rows is None:
+            splits = np.searchsorted(reals, bounds)
+        else:
+            partition_ids = np.searchsorted(bounds, reals, side="right") - 1
+            # The few partition numbers in a small integer type sort in linear time
+            sort_keys = partition_ids.astype(np.min_scalar_type(len(bounds)))
+            order = np.argsort(sort_keys, kind="stable")
+            rows = rows.take(order)
+            splits = np.searchsorted(partition_ids[order], np.arange(len(bounds)))
+
+    def sum_partition(start: int, end: int) -> pa.Table:
+        if rows is None:
+            partition = arrow_df.slice(start, end - start)
+            if mask is not None:
+                partition = partition.filter(mask.slice(start, end - start))
+        else:
+            partition = arrow_df.take(rows.slice(start, end - start))
+        return sum_per_real(
+            partition, columns_to_group_by_for_sum, volume_names, use_threads=False
         )
-        accumulated_table = accumulated_table.append_column("PORO_OIL", poro_array)
-
-    # Calculate statistics
-    valid_result_names = [
-        col for col in response_cols if col not in groupby_cols + ["REAL"]
-    ]
-    basic_statistics_functions = ["mean", "stddev"]
-    basic_statistics_aggregations = [
-        (result_name, func)
-        for result_name in valid_result_names
-        for func in basic_statistics_functions
-    ]
-    tdigest_options = pc.TDigestOptions([0.1, 0.9])  # p10 and p90
-    percentile_aggregations = [
-        (result_name, "tdigest", tdigest_options) for result_name in valid_result_names
-    ]
-    statistical_aggregations = basic_statistics_aggregations + percentile_aggregations
-    table_grouped_by = accumulated_table.group_by(groupby_cols)
-    statistical_table = table_grouped_by.aggregate(statistical_aggregations)
 
-    return statistical_table
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        partial_sums = list(executor.map(sum_partition, splits[:-1], splits[1:]))
+    return pa.concat_tables(partial_sums).unify_dictionaries()
 
 
 def get_numerical_column_names(table):
@@ -106,48 +205,3 @@ def get_numerical_column_names(table):
         for field in table.schema
         if pa.types.is_primitive(field.type) and field.type in numerical_types
     ]
-
-
-def calculate_property_from_volume_arrays(
-    property: str, nominator: pa.array, denominator: pa.array
-) -> pa.array:
-    """
-    Calculate property from two arrays of volumes
-
-    Assume equal length and dimension of arrays
-
-    """
-    safe_denominator = _create_safe_denominator_array(denominator)
-
-    result = None
-    if property == "PORO_OIL":
-        result = pc.divide(nominator, safe_denominator)
-    if property == "SW_OIL":
-        result = pc.subtract(1, pc.divide(nominator, safe_denominator))
-
-    if result is not None:
-        # return result
-        return _replace_nan_and_inf_with_null(result)
-
-    ValueError(f"Unhandled property: {property}")
-
-
-def _create_safe_denominator_array(denominator_array: pa.array) -> pa.array:
-    """
-    Create denominator array for safe division, i.e. replace 0 with np.nan
-    """
-    zero_mask = pc.equal(denominator_array, 0.0)
-    safe_denominator_array = pc.if_else(zero_mask, float("nan"), denominator_array)
-    return safe_denominator_array
-
-
-def _replace_nan_and_inf_with_null(array: pa.array) -> pa.array:
-    """
-    Replace NaN and Inf with null, this is needed for pyarrow to handle null values in aggregation
-
-    The None value is used to represent null values in pyarrow array
-
-    NOTE: if pyarrow is removed, this replacement is probably not needed
-    """
-    nan_or_inf_mask = pc.or_(pc.is_nan(array), pc.is_inf(array))
-    return pc.if_else(nan_or_inf_mask, None, array)
@@ -0,0 +1,252 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable
+
+import pyarrow as pa
+
+from .classes import IndexFilter
+from .dispatch import calc_grouped_statistics
+from .engines import convert_table, get_input_format, result_to_arrow
+from .numpy_stat import STATISTICS
+from .per_real_cache import get_filters_key
+from .sumo_utils import evict_cached_tables, get_sumo_table_fingerprint, read_cached_table
+
+if TYPE_CHECKING:
+    import pandas as pd
+    import polars as pl
+
+DEFAULT_MAX_BYTES = 256 * 1024**2
+DEFAULT_MAX_DISK_BYTES = 2 * 1024**3
+
+# Subdirectory of cache_dir for the results, so the eviction of the results and
+# of the Sumo table cache never remove each other's files when they share cache_dir
+RESULTS_SUBDIR = "results"
+
+
+class ResultCache:
+    """
+    Cache of grouped statistics results, keyed on the input table and the query
+
+    Results are kept in memory in an LRU bounded by bytes. With cache_dir they are
+    also written to its "results" subdirectory as Arrow IPC files, so worker
+    processes sharing the directory share the results, and cache_dir can be the
+    directory of the Sumo table cache. A memory miss is then looked up on disk
+    before the result is calculated. The hits, disk hits and misses are counted.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        cache_dir: str | None = None,
+        max_disk_bytes: int = DEFAULT_MAX_DISK_BYTES,
+    ):
+        self.max_bytes = max_bytes
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, pa.Table] = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key: str, compute: Callable[[], pa.Table]) -> pa.Table:
+        """Return the cached result for the key, or compute and cache it"""
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return result
+
+        if self.cache_dir is not None:
+            result = read_cached_table(self._get_disk_path(key))
+            if result is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._insert(key, result)
+                return result
+
+        result = compute()
+        with self._lock:
+            self.misses += 1
+            self._insert(key, result)
+        if self.cache_dir is not None:
+            self._write_to_disk(key, result)
+        return result
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "nbytes": self._nbytes,
+            }
+
+    def clear(self) -> None:
+        """Empty the memory tier and reset the counters, the disk tier is kept"""
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+            self.hits = 0
+            self.disk_hits = 0
+            self.misses = 0
+
+    def _insert(self, key: str, result: pa.Table) -> None:
+        if key in self._entries:
+            return
+        self._entries[key] = result
+        self._nbytes += result.nbytes
+        while self._entries and self._nbytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._nbytes -= evicted.nbytes
+
+    def _get_disk_path(self, key: str) -> Path:
+        return self.cache_dir / RESULTS_SUBDIR / f"{key}.arrow"
+
+    def _write_to_disk(self, key: str, result: pa.Table) -> None:
+        """Write a result to the disk tier, renamed into place so readers never see a partial file"""
+        path = self._get_disk_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with pa.ipc.new_file(str(tmp_path), result.schema) as writer:
+            writer.write_table(result)
+        os.replace(tmp_path, path)
+        evict_cached_tables(path.parent, self.max_disk_bytes, keep=path)
+
+
+## Keys
+def get_result_key(
+    table: pa.Table | pl.DataFrame | pd.DataFrame,
+    index_filters: list[IndexFilter],
+    groupby_cols: list[str],
+    response_cols: list[str],
+    engine: str,
+) -> str:
+    """
+    Return the cache key of a query against a table
+
+    The query is normalized, i.e. the order of the filters, groupby columns and
+    response columns does not matter.
+    """
+    key = json.dumps(
+        [
+            get_table_fingerprint(table),
+            get_filters_key(index_filters),
+            sorted(groupby_cols),
+            sorted(response_cols),
+            engine,
+        ],
+        default=str,
+    )
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+_fingerprints: dict[int, str] = {}
+_fingerprints_lock = threading.Lock()
+
+
+def get_table_fingerprint(table: pa.Table | pl.DataFrame | pd.DataFrame) -> str:
+    """
+    Return a fingerprint of the content of a table
+
+    Tables from the Sumo loaders carry a fingerprint of the Sumo object versions,
+    tables derived from them do not, see get_sumo_table_fingerprint. Other Arrow
+    tables are immutable, so they are hashed once and the hash is kept while the
+    table is alive. pandas and Polars frames can be changed in place, so they are
+    hashed on every call.
+    """
+    if not isinstance(table, pa.Table):
+        return f"buffers:{hash_table_buffers(result_to_arrow(table))}"
+
+    sumo_fingerprint = get_sumo_table_fingerprint(table)
+    if sumo_fingerprint is not None:
+        return f"sumo:{sumo_fingerprint}"
+
+    table_id = id(table)
+    with _fingerprints_lock:
+        fingerprint = _fingerprints.get(table_id)
+    if fingerprint is not None:
+        return fingerprint
+
+    fingerprint = f"buffers:{hash_table_buffers(table)}"
+
+    with _fingerprints_lock:
+        if table_id not in _fingerprints:
+            _fingerprints[table_id] = fingerprint
+            weakref.finalize(table, _fingerprints.pop, table_id, None)
+    return fingerprint
+
+
+def hash_table_buffers(arrow_table: pa.Table) -> str:
+    """Hash the schema, without the metadata, and the data buffers of an Arrow table"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(arrow_table.schema.remove_metadata()).encode())
+    for column in arrow_table.columns:
+        for chunk in column.chunks:
+            _hash_array(digest, chunk)
+    return digest.hexdigest()
+
+
+def _hash_array(digest, array: pa.Array) -> None:
+    # Buffers of sliced arrays extend beyond the slice, so the slice is part of the hash
+    digest.update(f"{array.offset}:{len(array)}".encode())
+    for buffer in array.buffers():
+        if buffer is not None:
+            digest.update(buffer)
+    if pa.types.is_dictionary(array.type):
+        _hash_array(digest, array.dictionary)
+
+
+## Cached entry point
+_default_cache = ResultCache()
+
+
+def calc_grouped_statistics_with_cache(
+    table: pa.Table | pl.DataFrame | pd.DataFrame,
+    index_filters: list[IndexFilter],
+    groupby_cols: list[str],
+    response_cols: list[str],
+    engine: str | None = None,
+    exact_percentiles: bool = True,
+    cache: ResultCache | None = None,
+):
+    """
+    Grouped statistics calculation with cached results
+
+    Same as calc_grouped_statistics in dispatch, but identical queries against the
+    same table content are answered from the cache. The result has the columns in
+    the order of the query, also when it was cached by a query in another order.
+    """
+    cache = cache if cache is not None else _default_cache
+    engine_key = engine if engine is not None else f"auto:{exact_percentiles}"
+    key = get_result_key(table, index_filters, groupby_cols, response_cols, engine_key)
+
+    result = cache.get_or_compute(
+        key,
+        lambda: result_to_arrow(
+            calc_grouped_statistics(
+                table,
+                index_filters,
+                groupby_cols,
+                response_cols,
+                engine=engine,
+                exact_percentiles=exact_percentiles,
+            )
+        ),
+    )
+    column_order = list(groupby_cols) + [
+        f"{col}_{stat}" for col in response_cols for stat in STATISTICS
+    ]
+    result = result.select([col for col in column_order if col in result.column_names])
+    return convert_table(result, get_input_format(table))
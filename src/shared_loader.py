@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import pyarrow as pa
+
+# The views import their library when used
+if TYPE_CHECKING:
+    import pandas as pd
+    import polars as pl
+    from sumo.wrapper import SumoClient
+
+from .sumo_utils import DEFAULT_MAX_CONCURRENCY, get_sumo_tables
+
+
+@dataclass
+class SharedTable:
+    """
+    A combined volume table, fetched once and viewed in the format of each engine
+
+    The views share the Arrow buffers of the table instead of copying them.
+    """
+
+    arrow: pa.Table
+
+    def to_arrow(self) -> pa.Table:
+        return self.arrow
+
+    def to_polars(self) -> pl.DataFrame:
+        import polars as pl
+
+        return pl.from_arrow(self.arrow)
+
+    def to_pandas(self) -> pd.DataFrame:
+        """Return a pandas DataFrame backed by the Arrow buffers (ArrowDtype columns)"""
+        import pandas as pd
+
+        return self.arrow.to_pandas(types_mapper=pd.ArrowDtype)
+
+
+class SharedTableLoader:
+    """
+    Loader of combined volume tables with single-flight fetching
+
+    Concurrent callers asking for the same table share one in-flight fetch: the
+    first caller fetches, the others wait for its result (or its error).
+    """
+
+    def __init__(self):
+        self._in_flight: dict[tuple, Future] = {}
+        self._lock = threading.Lock()
+
+    def load(
+        self,
+        client: SumoClient,
+        case_uuid: str,
+        table_name: str,
+        iteration_name: str,
+        response_cols: list[str] | None = None,
+        cache_dir: str | None = None,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        case_collection_class: type | None = None,
+    ) -> SharedTable:
+        key = (
+            case_uuid,
+            table_name,
+            iteration_name,
+            tuple(sorted(response_cols)) if response_cols is not None else None,
+            cache_dir,
+        )
+        with self._lock:
+            future = self._in_flight.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self._in_flight[key] = future
+
+        if not is_owner:
+            return future.result()
+
+        try:
+            arrow_table = get_sumo_tables(
+                client,
+                case_uuid,
+                table_name,
+                iteration_name,
+                as_pandas=False,
+                cache_dir=cache_dir,
+                response_cols=response_cols,
+                max_concurrency=max_concurrency,
+                case_collection_class=case_collection_class,
+            )
+            future.set_result(SharedTable(arrow_table))
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+        return future.result()
+
+
+_default_loader = SharedTableLoader()
+
+
+def load_shared_table(
+    client: SumoClient,
+    case_uuid: str,
+    table_name: str,
+    iteration_name: str,
+    response_cols: list[str] | None = None,
+    cache_dir: str | None = None,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    case_collection_class: type | None = None,
+) -> SharedTable:
+    """Fetch a combined volume table once, shared by concurrent callers"""
+    return _default_loader.load(
+        client,
+        case_uuid,
+        table_name,
+        iteration_name,
+        response_cols=response_cols,
+        cache_dir=cache_dir,
+        max_concurrency=max_concurrency,
+        case_collection_class=case_collection_class,
+    )
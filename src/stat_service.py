@@ -0,0 +1,293 @@
+import argparse
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+from dataclasses import asdict
+from typing import BinaryIO, Callable
+
+import pyarrow as pa
+
+from .classes import IndexFilter
+from .fake_sumo import FakeCaseCollection, FakeSumoClient
+from .result_cache import ResultCache, calc_grouped_statistics_with_cache
+from .shared_loader import SharedTableLoader
+from .sumo_utils import get_sumo_client
+from .timer import stage
+
+DEFAULT_SOCKET_PATH = "/tmp/grouped_statistics.sock"
+
+# Length prefix of the JSON headers, big-endian unsigned 32-bit
+HEADER_LENGTH = struct.Struct(">I")
+
+
+class StatisticsService:
+    """
+    Resident grouped statistics service
+
+    Keeps the combined volume tables in memory, keyed by case, iteration and table
+    name, so only the first query of a table pays for the Sumo load. The tables are
+    loaded with all volume columns, so any response can be asked for later. Results
+    are cached in a ResultCache. For the offline backend, pass FakeSumoClient as the
+    client_factory and FakeCaseCollection as the case_collection_class.
+    """
+
+    def __init__(
+        self,
+        client_factory: Callable = get_sumo_client,
+        cache_dir: str | None = None,
+        result_cache: ResultCache | None = None,
+        case_collection_class: type | None = None,
+    ):
+        self.client_factory = client_factory
+        self.case_collection_class = case_collection_class
+        self.cache_dir = cache_dir
+        self.result_cache = result_cache if result_cache is not None else ResultCache()
+        self._client = None
+        self._tables: dict[tuple[str, str, str], pa.Table] = {}
+        self._loader = SharedTableLoader()
+        self._lock = threading.Lock()
+
+    def get_table(self, case_uuid: str, iteration_name: str, table_name: str) -> pa.Table:
+        """Return a resident table, loading it on first use"""
+        key = (case_uuid, iteration_name, table_name)
+        with self._lock:
+            table = self._tables.get(key)
+            if self._client is None:
+                self._client = self.client_factory()
+        if table is not None:
+            return table
+
+        # Concurrent first queries of the same table share one load
+        table = self._loader.load(
+            self._client,
+            case_uuid,
+            table_name,
+            iteration_name,
+            cache_dir=self.cache_dir,
+            case_collection_class=self.case_collection_class,
+        ).to_arrow()
+        with self._lock:
+            return self._tables.setdefault(key, table)
+
+    def unload(self, case_uuid: str, iteration_name: str, table_name: str) -> bool:
+        """Drop a resident table, e.g. after a new version is uploaded, return if it was loaded"""
+        key = (case_uuid, iteration_name, table_name)
+        with self._lock:
+            return self._tables.pop(key, None) is not None
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            tables = [
+                {
+                    "case_uuid": case_uuid,
+                    "iteration_name": iteration_name,
+                    "table_name": table_name,
+                    "nbytes": table.nbytes,
+                }
+                for (case_uuid, iteration_name, table_name), table in self._tables.items()
+            ]
+        return {"tables": tables, "result_cache": self.result_cache.stats}
+
+    def query(self, request: dict) -> pa.Table:
+        """Answer a query request, see StatisticsClient.query for the fields"""
+        table = self.get_table(
+            request["case_uuid"], request["iteration_name"], request["table_name"]
+        )
+        index_filters = [
+            IndexFilter(**index_filter)
+            for index_filter in request.get("index_filters", [])
+        ]
+        return calc_grouped_statistics_with_cache(
+            table,
+            index_filters,
+            request.get("groupby_cols", []),
+            request["response_cols"],
+            engine=request.get("engine"),
+            exact_percentiles=request.get("exact_percentiles", True),
+            cache=self.result_cache,
+        )
+
+
+class StatisticsRequestHandler(socketserver.StreamRequestHandler):
+    """Answers the requests of one connection until the client closes it"""
+
+    def handle(self):
+        service: StatisticsService = self.server.service
+        while True:
+            request = read_header(self.rfile)
+            if request is None:
+                return
+            try:
+                with stage("service_request", kind=request.get("kind", "query")):
+                    if request.get("kind") == "stats":
+                        write_message(self.wfile, {"status": "ok", **service.stats})
+                    elif request.get("kind") == "unload":
+                        unloaded = service.unload(
+                            request["case_uuid"],
+                            request["iteration_name"],
+                            request["table_name"],
+                        )
+                        write_message(self.wfile, {"status": "ok", "unloaded": unloaded})
+                    else:
+                        result = service.query(request)
+                        write_message(self.wfile, {"status": "ok"}, result)
+            except Exception as error:
+                # Reported to the client, the connection stays usable
+                error_header = {
+                    "status": "error",
+                    "error": type(error).__name__,
+                    "message": str(error),
+                }
+                write_message(self.wfile, error_header)
+
+
+def make_server(
+    service: StatisticsService, socket_path: str = DEFAULT_SOCKET_PATH
+) -> socketserver.ThreadingUnixStreamServer:
+    """
+    Return a server on a Unix socket with a thread per connection, run with serve_forever()
+
+    A socket file left by a stopped server is replaced, but not the socket of a
+    server that still answers.
+    """
+    if os.path.exists(socket_path):
+        if is_serving(socket_path):
+            raise RuntimeError(f"A server is already serving on {socket_path}")
+        os.unlink(socket_path)
+    server = socketserver.ThreadingUnixStreamServer(socket_path, StatisticsRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def is_serving(socket_path: str) -> bool:
+    """Return if a server accepts connections on the Unix socket"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(socket_path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            return False
+    return True
+
+
+class StatisticsClient:
+    """Client of the statistics service, keeps one connection open for many queries"""
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET_PATH):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(socket_path)
+        self._rfile = self._socket.makefile("rb")
+        self._wfile = self._socket.makefile("wb")
+
+    def query(
+        self,
+        case_uuid: str,
+        iteration_name: str,
+        table_name: str,
+        index_filters: list[IndexFilter],
+        groupby_cols: list[str],
+        response_cols: list[str],
+        engine: str | None = None,
+        exact_percentiles: bool = True,
+    ) -> pa.Table:
+        """Return the grouped statistics of a resident table, with Polars engine columns"""
+        _, result = self._request(
+            {
+                "kind": "query",
+                "case_uuid": case_uuid,
+                "iteration_name": iteration_name,
+                "table_name": table_name,
+                "index_filters": [asdict(index_filter) for index_filter in index_filters],
+                "groupby_cols": groupby_cols,
+                "response_cols": response_cols,
+                "engine": engine,
+                "exact_percentiles": exact_percentiles,
+            }
+        )
+        return result
+
+    def stats(self) -> dict:
+        """Return the resident tables and the result cache statistics of the service"""
+        header, _ = self._request({"kind": "stats"})
+        return {"tables": header["tables"], "result_cache": header["result_cache"]}
+
+    def unload(self, case_uuid: str, iteration_name: str, table_name: str) -> bool:
+        header, _ = self._request(
+            {
+                "kind": "unload",
+                "case_uuid": case_uuid,
+                "iteration_name": iteration_name,
+                "table_name": table_name,
+            }
+        )
+        return header["unloaded"]
+
+    def close(self) -> None:
+        self._rfile.close()
+        self._wfile.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _request(self, request: dict) -> tuple[dict, pa.Table | None]:
+        write_message(self._wfile, request)
+        header, table = read_message(self._rfile)
+        if header["status"] != "ok":
+            raise RuntimeError(f"{header['error']}: {header['message']}")
+        return header, table
+
+
+## Wire format
+# A message is a length-prefixed JSON header, followed by an Arrow IPC stream if
+# the header has "table": true. The IPC stream ends with its end-of-stream marker.
+def write_message(wfile: BinaryIO, header: dict, table: pa.Table | None = None) -> None:
+    header_bytes = json.dumps({**header, "table": table is not None}).encode()
+    wfile.write(HEADER_LENGTH.pack(len(header_bytes)) + header_bytes)
+    if table is not None:
+        with pa.ipc.new_stream(wfile, table.schema) as writer:
+            writer.write_table(table)
+    wfile.flush()
+
+
+def read_header(rfile: BinaryIO) -> dict | None:
+    """Read a message header, None when the connection is closed"""
+    length_bytes = rfile.read(HEADER_LENGTH.size)
+    if len(length_bytes) < HEADER_LENGTH.size:
+        return None
+    (length,) = HEADER_LENGTH.unpack(length_bytes)
+    return json.loads(rfile.read(length))
+
+
+def read_message(rfile: BinaryIO) -> tuple[dict, pa.Table | None]:
+    header = read_header(rfile)
+    if header is None:
+        raise ConnectionError("The statistics service closed the connection")
+    table = pa.ipc.open_stream(rfile).read_all() if header["table"] else None
+    return header, table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resident grouped statistics service")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET_PATH)
+    parser.add_argument("--cache-dir", default=None)
+    parser.add_argument(
+        "--fake", action="store_true", help="Serve synthetic tables from the fake backend"
+    )
+    args = parser.parse_args()
+
+    statistics_service = StatisticsService(
+        client_factory=FakeSumoClient if args.fake else get_sumo_client,
+        cache_dir=args.cache_dir,
+        case_collection_class=FakeCaseCollection if args.fake else None,
+    )
+    with make_server(statistics_service, args.socket) as statistics_server:
+        print(f"Serving grouped statistics on {args.socket}")
+        statistics_server.serve_forever()
@@ -0,0 +1,129 @@
+from typing import Iterable, Iterator
+
+import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .classes import IndexFilter
+from .index_columns import get_index_mask_arrow
+from .derived_properties import get_required_volume_columns
+from .polars_stat import calc_grouped_statistics_from_per_real_sums
+from .timer import staged
+
+# Number of partial sum rows to collect before they are folded together
+DEFAULT_MAX_PARTIAL_ROWS = 1_000_000
+
+
+@staged
+def calc_grouped_statistics_streaming(
+    batches: Iterable[pa.RecordBatch | pa.Table],
+    index_filters: list[IndexFilter],
+    groupby_cols: list[str],
+    response_cols: list[str],
+    drop_nans: bool = True,
+    max_partial_rows: int = DEFAULT_MAX_PARTIAL_ROWS,
+) -> pl.DataFrame:
+    """
+    Streaming implementation of grouped statistics calculation
+
+    Each batch is filtered and summed per REAL and group on its own, and the partial
+    sums are folded together. The sums are additive, so the batches can be any split
+    of the rows, e.g. blocks of realizations. Peak memory scales with the number of
+    REAL and group combinations instead of the number of rows.
+    """
+    per_group_with_real = ["REAL"] + groupby_cols
+    partial_sums = []
+    partial_rows = 0
+    df_cols = None
+    volume_cols = None
+    for batch in batches:
+        if df_cols is None:
+            df_cols = batch.schema.names
+            volume_cols = get_required_volume_columns(df_cols, response_cols)
+
+        batch_sums = sum_batch_per_real(
+            batch, index_filters, per_group_with_real, volume_cols
+        )
+        partial_sums.append(batch_sums)
+        partial_rows += batch_sums.num_rows
+
+        # Fold the partial sums when they grow, this keeps at most one row per REAL and group
+        if partial_rows > max_partial_rows:
+            partial_sums = [fold_partial_sums(partial_sums, per_group_with_real)]
+            partial_rows = partial_sums[0].num_rows
+
+    if df_cols is None:
+        raise ValueError("No batches to calculate statistics from")
+    per_group_summed = pl.from_arrow(
+        fold_partial_sums(partial_sums, per_group_with_real)
+    )
+    return calc_grouped_statistics_from_per_real_sums(
+        per_group_summed, groupby_cols, response_cols, drop_nans
+    )
+
+
+def sum_batch_per_real(
+    batch: pa.RecordBatch | pa.Table,
+    index_filters: list[IndexFilter],
+    per_group_with_real: list[str],
+    volume_cols: list[str],
+) -> pa.Table:
+    """Filter one batch and sum the volumes per REAL and group"""
+    table = pa.Table.from_batches([batch]) if isinstance(batch, pa.RecordBatch) else batch
+    filter_cols = ["ZONE", "REGION", "FACIES"] + [f.name for f in index_filters]
+    table = table.select(
+        list(dict.fromkeys(per_group_with_real + filter_cols + volume_cols))
+    ).unify_dictionaries()
+
+    # Cleanup bad data and filter on indexes, only the summed columns are copied
+    mask = get_index_mask_arrow(table, index_filters)
+    table = table.select(list(dict.fromkeys(per_group_with_real + volume_cols)))
+    if mask is not None:
+        table = table.filter(mask)
+
+    return sum_per_group(table, per_group_with_real, volume_cols)
+
+
+def fold_partial_sums(
+    partial_sums: list[pa.Table], per_group_with_real: list[str]
+) -> pa.Table:
+    """Combine partial sums into one row per REAL and group"""
+    volume_cols = [
+        col for col in partial_sums[0].column_names if col not in per_group_with_real
+    ]
+    combined = pa.concat_tables(partial_sums).unify_dictionaries()
+    return sum_per_group(combined, per_group_with_real, volume_cols)
+
+
+def sum_per_group(
+    table: pa.Table, per_group_with_real: list[str], volume_cols: list[str]
+) -> pa.Table:
+    """Sum the volume columns per group, keeping the original column names"""
+    summed = table.group_by(per_group_with_real).aggregate(
+        [(col, "sum") for col in volume_cols]
+    )
+    return summed.rename_columns([col.removesuffix("_sum") for col in summed.column_names])
+
+
+## Batch sources
+def iter_table_batches(
+    table: pa.Table, max_chunksize: int = 1_000_000
+) -> Iterator[pa.RecordBatch]:
+    """Iterate over a table in record batches of at most max_chunksize rows"""
+    yield from table.to_batches(max_chunksize=max_chunksize)
+
+
+def iter_ipc_file_batches(path: str) -> Iterator[pa.RecordBatch]:
+    """Iterate over the record batches of a memory-mapped Arrow IPC file, e.g. a cached Sumo table"""
+    with pa.memory_map(str(path), "r") as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i)
+
+
+def iter_parquet_file_batches(
+    path: str, columns: list[str] | None = None, batch_size: int = 1_000_000
+) -> Iterator[pa.RecordBatch]:
+    """Iterate over the record batches of a Parquet file, reading only the given columns"""
+    parquet_file = pq.ParquetFile(path)
+    yield from parquet_file.iter_batches(batch_size=batch_size, columns=columns)
@@ -1,17 +1,48 @@
+from __future__ import annotations
+
 import asyncio
-import pandas as pd
-from sumo.wrapper import SumoClient
-from fmu.sumo.explorer.objects import CaseCollection, Table
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING
+
 import pyarrow as pa
 import pyarrow.compute as pc
 
-from .timer import time_this, timing_data
+# The Sumo client libraries are imported when Sumo is used, not by the cache helpers
+if TYPE_CHECKING:
+    from sumo.wrapper import SumoClient
+    from fmu.sumo.explorer.objects import Table
+
+from .index_columns import INDEX_COLUMNS, dictionary_encode_index_columns
+from .derived_properties import get_required_volume_columns
+from .timer import is_tracing, stage, time_this, timing_data
+
+DEFAULT_MAX_CACHE_BYTES = 10 * 1024**3
+DEFAULT_MAX_CONCURRENCY = 8
+
+# Schema metadata key for the fingerprint of the Sumo objects a table is combined from
+SUMO_FINGERPRINT_KEY = b"sumo_fingerprint"
+# Schema metadata key for the layout of the table the fingerprint was set on, see
+# get_sumo_table_fingerprint
+SUMO_LAYOUT_KEY = b"sumo_layout"
 
 
 ## Sumo helpers
 @time_this
-def get_sumo_client(env: str = "prod"):
-    return SumoClient(env=env)
+def get_sumo_client(env: str = "prod", max_connections: int | None = None):
+    """Return a Sumo client, optionally with a bounded pool of async connections"""
+    from sumo.wrapper import SumoClient
+
+    if max_connections is None:
+        return SumoClient(env=env)
+    import httpx
+
+    async_http_client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=max_connections)
+    )
+    return SumoClient(env=env, async_http_client=async_http_client)
 
 
 @time_this
@@ -21,81 +52,367 @@ def get_sumo_tables(
     table_name: str,
     iteration_name: str,
     as_pandas: bool,
+    cache_dir: str | None = None,
+    max_cache_bytes: int = DEFAULT_MAX_CACHE_BYTES,
+    response_cols: list[str] | None = None,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    case_collection_class: type | None = None,
 ):
+    """Fetch the combined volume table from Sumo
+
+    If cache_dir is given, the combined table is stored there as an Arrow IPC file
+    and later loads are memory-mapped from disk. The network is only used on a miss,
+    i.e. when the table has not been cached or the Sumo objects have changed.
+
+    If response_cols is given, only the volume tables needed for them are fetched,
+    including the inputs of derived properties. At most max_concurrency tables are
+    fetched at the same time.
+
+    case_collection_class replaces the fmu.sumo.explorer CaseCollection, e.g.
+    FakeCaseCollection with a FakeSumoClient.
+    """
     if as_pandas:
         return asyncio.run(
-            get_sumo_tables_pandas_async(client, case_uuid, table_name, iteration_name)
+            get_sumo_tables_pandas_async(
+                client,
+                case_uuid,
+                table_name,
+                iteration_name,
+                cache_dir=cache_dir,
+                max_cache_bytes=max_cache_bytes,
+                response_cols=response_cols,
+                max_concurrency=max_concurrency,
+                case_collection_class=case_collection_class,
+            )
         )
     else:
         return asyncio.run(
-            get_sumo_tables_arrow_async(client, case_uuid, table_name, iteration_name)
+            get_sumo_tables_arrow_async(
+                client,
+                case_uuid,
+                table_name,
+                iteration_name,
+                cache_dir=cache_dir,
+                max_cache_bytes=max_cache_bytes,
+                response_cols=response_cols,
+                max_concurrency=max_concurrency,
+                case_collection_class=case_collection_class,
+            )
         )
 
 
-async def get_sumo_tables_pandas_async(
-    client: SumoClient, case_uuid: str, table_name: str, iteration_name: str
-):
-    """Fetch all table columns from Sumo"""
-    case = CaseCollection(sumo=client).filter(uuid=case_uuid)[0]
+def get_volume_tables(
+    client: SumoClient,
+    case_uuid: str,
+    table_name: str,
+    iteration_name: str,
+    volume_cols: list[str] | None = None,
+    case_collection_class: type | None = None,
+) -> list[Table]:
+    """
+    Get the metadata of the volume table objects, without fetching any blobs
+
+    Each table object holds the index columns and one volume column. If volume_cols
+    is given, Sumo returns only the tables with those volume columns.
+    case_collection_class defaults to the fmu.sumo.explorer CaseCollection.
+    """
+    if case_collection_class is None:
+        from fmu.sumo.explorer.objects import CaseCollection
+
+        case_collection_class = CaseCollection
+    case = case_collection_class(sumo=client).filter(uuid=case_uuid)[0]
     vol_table_collection = case.tables.filter(
         aggregation="collection",
         tagname=["vol", "volumes", "inplace"],
         iteration=iteration_name,
         name=table_name,
+        column=volume_cols,
     )
+    vol_tables = list(vol_table_collection)
+    if not vol_tables:
+        raise ValueError(
+            f"No volume tables found for case {case_uuid}, iteration {iteration_name}, "
+            f"table {table_name} and columns {volume_cols}"
+        )
+    return vol_tables
 
-    async def fetch_table_pandas(table: Table) -> pd.DataFrame:
-        df = await table.to_pandas_async()
-        return df
 
-    dfs_duped = await asyncio.gather(
-        *[fetch_table_pandas(table) for table in vol_table_collection]
-    )
-    dfs = []
-    for df in dfs_duped:
-        index_cols = ["REAL", "ZONE", "REGION", "FACIES"]
-        df.set_index(index_cols, inplace=True)
-        result_col = [col for col in df.columns if col not in index_cols][0]
-        df = df[[result_col]]
-        dfs.append(df)
+def get_table_columns(table: Table) -> list[str]:
+    """Return the column names of a table object from its metadata"""
+    return table.metadata.get("data", {}).get("spec", {}).get("columns", [])
 
-    df = pd.concat(dfs, axis=1)
-    df.reset_index(inplace=True)
-    return df
+
+async def get_sumo_tables_pandas_async(
+    client: SumoClient,
+    case_uuid: str,
+    table_name: str,
+    iteration_name: str,
+    cache_dir: str | None = None,
+    max_cache_bytes: int = DEFAULT_MAX_CACHE_BYTES,
+    response_cols: list[str] | None = None,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    case_collection_class: type | None = None,
+):
+    """
+    Fetch the table columns from Sumo as a pandas DataFrame
+
+    The columns are combined in Arrow and converted once, the dictionary encoded
+    index columns become categoricals.
+    """
+    arrow_table = await get_sumo_tables_arrow_async(
+        client,
+        case_uuid,
+        table_name,
+        iteration_name,
+        cache_dir=cache_dir,
+        max_cache_bytes=max_cache_bytes,
+        response_cols=response_cols,
+        max_concurrency=max_concurrency,
+        case_collection_class=case_collection_class,
+    )
+    with stage("to_pandas"):
+        return arrow_table.to_pandas()
 
 
 async def get_sumo_tables_arrow_async(
-    client: SumoClient, case_uuid: str, table_name: str, iteration_name: str
+    client: SumoClient,
+    case_uuid: str,
+    table_name: str,
+    iteration_name: str,
+    cache_dir: str | None = None,
+    max_cache_bytes: int = DEFAULT_MAX_CACHE_BYTES,
+    response_cols: list[str] | None = None,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    case_collection_class: type | None = None,
 ):
-    """Fetch all table columns from Sumo"""
-    case = CaseCollection(sumo=client).filter(uuid=case_uuid)[0]
-    vol_table_collection = case.tables.filter(
-        aggregation="collection",
-        tagname=["vol", "volumes", "inplace"],
-        iteration=iteration_name,
-        name=table_name,
-    )
+    """Fetch the table columns from Sumo, all or only those needed for response_cols"""
+    volume_cols = None
+    if response_cols is not None:
+        volume_cols = get_required_volume_columns(None, response_cols)
+    with stage("get_volume_tables"):
+        vol_tables = get_volume_tables(
+            client,
+            case_uuid,
+            table_name,
+            iteration_name,
+            volume_cols,
+            case_collection_class=case_collection_class,
+        )
+
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = get_cache_path(
+            cache_dir,
+            "arrow",
+            case_uuid,
+            iteration_name,
+            table_name,
+            vol_tables,
+            volume_cols,
+        )
+        with stage("read_cached_table"):
+            cached_table = read_cached_table(cache_path)
+        if cached_table is not None:
+            return set_sumo_fingerprint(cached_table, get_sumo_fingerprint(vol_tables))
+
+    # Limit the number of concurrent requests to the backend
+    semaphore = asyncio.Semaphore(max_concurrency)
 
     async def fetch_table_arrow(table: Table) -> pa.Table:
-        # Fetch the table as an Arrow Table
-        arrow_table = await table.to_arrow_async()
-        return arrow_table
+        # Fetch the table as an Arrow Table. The queued stage includes the wait for a
+        # free slot, the nested fetch_table stage is the fetch itself
+        with stage("queued_fetch_table"):
+            async with semaphore:
+                trace_args = {}
+                if is_tracing():
+                    trace_args = {"uuid": table.uuid, "columns": get_table_columns(table)}
+                with stage("fetch_table", **trace_args):
+                    return await table.to_arrow_async()
 
-    # Fetch all Arrow tables concurrently
+    # Fetch the Arrow tables concurrently
     arrow_tables = await asyncio.gather(
-        *[fetch_table_arrow(table) for table in vol_table_collection]
+        *[fetch_table_arrow(table) for table in vol_tables]
     )
 
-    index_cols = ["REAL", "ZONE", "REGION", "FACIES"]
-    combined_table = arrow_tables[0]
-    for i in range(1, len(arrow_tables)):
-        volume_table: pa.Table = arrow_tables[i]
-        # Keep only the index columns and the first result column
-        volume_name = [
-            col for col in volume_table.column_names if col not in index_cols
-        ][0]
-        volume_column = volume_table[volume_name]
-        combined_table = combined_table.append_column(volume_name, volume_column)
+    with stage("combine_tables"):
+        combined_table = join_volume_tables(arrow_tables)
+
+        # Low-cardinality index columns are filtered and grouped on integer codes
+        combined_table = dictionary_encode_index_columns(combined_table)
+
+    # Lets the result cache identify the table without hashing its data
+    combined_table = set_sumo_fingerprint(combined_table, get_sumo_fingerprint(vol_tables))
+
+    if cache_path is not None:
+        with stage("write_cached_table"):
+            write_cached_table(cache_path, combined_table, max_cache_bytes)
 
     # Return the final combined Arrow table
     return combined_table
+
+
+def join_volume_tables(arrow_tables: list[pa.Table]) -> pa.Table:
+    """
+    Combine the per-column tables into one table, joined on the index columns
+
+    The tables of a collection normally have the same index rows in the same order,
+    then the volume columns are appended without copying. Otherwise the tables are
+    joined on the index columns.
+    """
+    combined_table = arrow_tables[0]
+    index_cols = [col for col in INDEX_COLUMNS if col in combined_table.column_names]
+    for volume_table in arrow_tables[1:]:
+        # Keep only the volume columns that are not already in the combined table
+        volume_names = [
+            col
+            for col in volume_table.column_names
+            if col not in INDEX_COLUMNS and col not in combined_table.column_names
+        ]
+        if not volume_names:
+            continue
+        if combined_table.select(index_cols).equals(volume_table.select(index_cols)):
+            for volume_name in volume_names:
+                combined_table = combined_table.append_column(
+                    volume_name, volume_table[volume_name]
+                )
+        else:
+            combined_table = combined_table.join(
+                volume_table.select(index_cols + volume_names),
+                keys=index_cols,
+                join_type="full outer",
+            )
+    return combined_table
+
+
+## Local table cache
+def get_object_version(table: Table) -> str:
+    """Return a version identifier for a Sumo object, changes when the blob changes"""
+    sumo_info = table.metadata.get("_sumo", {})
+    return f"{table.uuid}:{sumo_info.get('blob_md5') or sumo_info.get('timestamp')}"
+
+
+def get_cache_path(
+    cache_dir: str,
+    kind: str,
+    case_uuid: str,
+    iteration_name: str,
+    table_name: str,
+    vol_tables: list[Table],
+    volume_cols: list[str] | None = None,
+) -> Path:
+    """
+    Return the cache file path for a combined table
+
+    The file name is made of a key for the table itself and a key for the object
+    versions, so a changed object in Sumo gives a new path, i.e. a cache miss.
+    """
+    columns_key = sorted(volume_cols) if volume_cols is not None else None
+    table_key = json.dumps([kind, case_uuid, iteration_name, table_name, columns_key])
+    table_hash = hashlib.sha256(table_key.encode()).hexdigest()[:16]
+    versions_hash = get_sumo_fingerprint(vol_tables)
+    return Path(cache_dir) / f"{table_hash}-{versions_hash}.arrow"
+
+
+def get_sumo_fingerprint(vol_tables: list[Table]) -> str:
+    """Return a fingerprint of the versions of the Sumo objects, changes when any object changes"""
+    versions_key = json.dumps(sorted(get_object_version(t) for t in vol_tables))
+    return hashlib.sha256(versions_key.encode()).hexdigest()[:16]
+
+
+def set_sumo_fingerprint(table: pa.Table, fingerprint: str) -> pa.Table:
+    """Return the table with the fingerprint of its Sumo objects in the schema metadata"""
+    return table.replace_schema_metadata(
+        {
+            **(table.schema.metadata or {}),
+            SUMO_FINGERPRINT_KEY: fingerprint.encode(),
+            SUMO_LAYOUT_KEY: get_table_layout(table).encode(),
+        }
+    )
+
+
+def get_sumo_table_fingerprint(table: pa.Table) -> str | None:
+    """
+    Return the fingerprint of the Sumo objects a table was loaded from, if any
+
+    The schema metadata is kept by filter, slice, select and so on, so the
+    fingerprint is only used for the table it was set on, i.e. with the same
+    columns, rows and buffers. Other tables give None.
+    """
+    metadata = table.schema.metadata or {}
+    if SUMO_FINGERPRINT_KEY not in metadata or SUMO_LAYOUT_KEY not in metadata:
+        return None
+    if metadata[SUMO_LAYOUT_KEY].decode() != get_table_layout(table):
+        return None
+    return metadata[SUMO_FINGERPRINT_KEY].decode()
+
+
+def get_table_layout(table: pa.Table) -> str:
+    """Return a hash of the column names, the row count and the buffer addresses of a table"""
+    layout = [table.num_rows]
+    for name, column in zip(table.column_names, table.columns):
+        layout.append(name)
+        for chunk in column.chunks:
+            layout.append((chunk.offset, len(chunk)))
+            layout.extend(buffer.address for buffer in chunk.buffers() if buffer is not None)
+    return hashlib.sha256(json.dumps(layout).encode()).hexdigest()[:16]
+
+
+def read_cached_table(cache_path: Path) -> pa.Table | None:
+    """Memory-map a cached table, the returned table references the file without copying"""
+    if not cache_path.exists():
+        return None
+    try:
+        source = pa.memory_map(str(cache_path), "r")
+        table = pa.ipc.open_file(source).read_all()
+    except (OSError, pa.ArrowInvalid):
+        # Partially written or corrupt file, treat as a miss
+        return None
+
+    # Mark as recently used for the eviction
+    os.utime(cache_path)
+    return table
+
+
+def write_cached_table(
+    cache_path: Path, table: pa.Table, max_cache_bytes: int
+) -> None:
+    """
+    Write a table to the cache as an uncompressed Arrow IPC file
+
+    The file is written to a temporary path and renamed, so readers never see a
+    partial file. Stale versions of the same table are removed.
+    """
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+    with pa.ipc.new_file(str(tmp_path), table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp_path, cache_path)
+
+    table_hash = cache_path.name.split("-")[0]
+    for stale_path in cache_path.parent.glob(f"{table_hash}-*.arrow"):
+        if stale_path != cache_path:
+            stale_path.unlink(missing_ok=True)
+
+    evict_cached_tables(cache_path.parent, max_cache_bytes, keep=cache_path)
+
+
+def evict_cached_tables(
+    cache_dir: Path, max_cache_bytes: int, keep: Path | None = None
+) -> None:
+    """Remove the least recently used cached tables until the cache fits in max_cache_bytes"""
+    cached_files = []
+    for path in cache_dir.glob("*.arrow"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        cached_files.append((stat.st_mtime, stat.st_size, path))
+
+    total_size = sum(size for _, size, _ in cached_files)
+    for _, size, path in sorted(cached_files):
+        if total_size <= max_cache_bytes:
+            break
+        if path == keep:
+            continue
+        path.unlink(missing_ok=True)
+        total_size -= size
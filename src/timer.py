@@ -1,4 +1,13 @@
+import json
+import os
+import resource
+import statistics
+import sys
+import threading
 import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
 from functools import wraps
 from typing import Callable, Any
 
@@ -9,9 +18,10 @@ timing_data = {}
 def time_this(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
-        start_time = time.time()
-        result = func(*args, **kwargs)
-        end_time = time.time()
+        start_time = time.perf_counter()
+        with stage(func.__name__):
+            result = func(*args, **kwargs)
+        end_time = time.perf_counter()
         elapsed_time = end_time - start_time
         timing_data[func.__name__] = f"{elapsed_time:.5f}s"
         return result
@@ -36,3 +46,360 @@ def time_many(runs: int = 100):
             return result
         return wrapper
     return decorator
+
+
+def measure(func: Callable[[], Any], runs: int = 20, warmup: int = 3) -> dict:
+    """
+    Time repeated calls of func and return the timing distribution
+
+    The warmup calls are not recorded. Peak memory is measured in a separate
+    call with tracemalloc, since tracing slows down the timed calls. Note that
+    tracemalloc only sees allocations made through Python and NumPy, not the
+    native Arrow and Polars allocators.
+    """
+    for _ in range(warmup):
+        func()
+
+    times = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        func()
+        end_time = time.perf_counter()
+        times.append(end_time - start_time)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak_traced_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "runs": runs,
+        "warmup": warmup,
+        "min": min(times),
+        "median": statistics.median(times),
+        "p95": _get_p95(times),
+        "mean": statistics.mean(times),
+        "stddev": statistics.pstdev(times),
+        "peak_traced_bytes": peak_traced_bytes,
+    }
+
+
+def _get_p95(times: list[float]) -> float:
+    """Linear interpolation between the closest ranks, as numpy.percentile"""
+    if len(times) < 2:
+        return times[0]
+    return statistics.quantiles(times, n=100, method="inclusive")[94]
+
+
+## Stage profiling and tracing
+# Records of the stages run while profiling, see profiling()
+stage_data: list[dict] = []
+# Chrome trace events of the stages run while tracing, see tracing()
+trace_events: list[dict] = []
+
+_profiling_enabled = False
+_tracing_enabled = False
+_trace_start_ns = 0
+_trace_threads: dict[int, str] = {}
+# The innermost open stage, per thread and asyncio task
+_current_stage: ContextVar["stage | None"] = ContextVar("current_stage", default=None)
+
+
+class stage:
+    """
+    Context manager recording the time and memory of a named stage
+
+    Does nothing unless profiling or tracing is enabled, so stages can be left in
+    the engines and loaders. Stages nest per thread and asyncio task, a stage opened
+    in a task is nested in the stage the task was created in. Keyword arguments
+    are added to the trace event, e.g. stage("fetch_table", uuid=table.uuid), compute
+    costly ones only if is_tracing().
+
+    While profiling, nested stages are recorded with their full path, e.g.
+    "outer/inner". Recorded:
+
+    - seconds: wall time
+    - rss_delta: change of the resident set size
+    - peak_rss_increase: how much the stage raised the peak RSS of the process
+    - traced_delta, traced_peak: tracemalloc change and peak above the start, if tracing
+    - arrow_delta: change of the bytes allocated in the Arrow default memory pool
+    - arrow_peak_increase: how much the stage raised the Arrow pool high-water mark
+
+    Polars and NumPy allocate outside the Arrow pool, and Polars has no allocation
+    statistics, so their memory shows up in the RSS figures (and NumPy also in
+    tracemalloc) only. The memory figures are for the whole process, so they mix
+    stages running concurrently.
+
+    While tracing, each stage is a Chrome trace event, see tracing().
+    """
+
+    __slots__ = (
+        "name",
+        "args",
+        "active",
+        "path",
+        "parent",
+        "token",
+        "start_ns",
+        "start",
+        "traced_peak",
+    )
+
+    def __init__(self, name: str, **args):
+        self.name = name
+        self.args = args
+        self.active = False
+
+    def __enter__(self):
+        if not (_profiling_enabled or _tracing_enabled):
+            return self
+        self.active = True
+        self.parent = _current_stage.get()
+        self.path = f"{self.parent.path}/{self.name}" if self.parent else self.name
+        self.token = _current_stage.set(self)
+        self.start = None
+        self.traced_peak = 0
+        if _profiling_enabled:
+            if tracemalloc.is_tracing():
+                # The peak is reset per stage, keep the peak seen so far for the parent
+                current, peak = tracemalloc.get_traced_memory()
+                if self.parent is not None and self.parent.start is not None:
+                    self.parent.traced_peak = max(self.parent.traced_peak, peak)
+                tracemalloc.reset_peak()
+                self.traced_peak = current
+            self.start = _get_memory_snapshot()
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        if not self.active:
+            return False
+        end_ns = time.perf_counter_ns()
+        self.active = False
+        try:
+            _current_stage.reset(self.token)
+        except ValueError:
+            # Exited in another context than entered, e.g. a generator resumed elsewhere
+            _current_stage.set(self.parent)
+        if _tracing_enabled:
+            _add_trace_event(self, end_ns)
+        if self.start is not None and _profiling_enabled:
+            self._add_record()
+        return False
+
+    def _add_record(self) -> None:
+        end = _get_memory_snapshot()
+        record = {
+            "stage": self.path,
+            "seconds": end["time"] - self.start["time"],
+            "rss_delta": _difference(end["rss"], self.start["rss"]),
+            "peak_rss_increase": _difference(end["peak_rss"], self.start["peak_rss"]),
+            "arrow_delta": end["arrow_allocated"] - self.start["arrow_allocated"],
+            "arrow_peak_increase": end["arrow_peak"] - self.start["arrow_peak"],
+        }
+        if tracemalloc.is_tracing() and self.start["traced"] is not None:
+            current, peak = tracemalloc.get_traced_memory()
+            self.traced_peak = max(self.traced_peak, peak)
+            record["traced_delta"] = current - self.start["traced"]
+            record["traced_peak"] = self.traced_peak - self.start["traced"]
+            if self.parent is not None and self.parent.start is not None:
+                self.parent.traced_peak = max(self.parent.traced_peak, self.traced_peak)
+        stage_data.append(record)
+
+
+def staged(func):
+    """Decorator running func in a stage named after it"""
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with stage(func.__name__):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+@contextmanager
+def profiling(trace_python: bool = True):
+    """
+    Enable the stage recording, and yield the list the records are appended to
+
+    With trace_python, tracemalloc is started for the Python and NumPy allocations,
+    which slows down Python heavy code.
+    """
+    global _profiling_enabled
+    stage_data.clear()
+    started_tracing = trace_python and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    _profiling_enabled = True
+    try:
+        yield stage_data
+    finally:
+        _profiling_enabled = False
+        if started_tracing:
+            tracemalloc.stop()
+
+
+@contextmanager
+def tracing(path: str | None = None):
+    """
+    Enable the stage tracing, and yield the list the trace events are appended to
+
+    The events are in the Chrome trace event format, viewable in Perfetto or
+    chrome://tracing. Stages in a thread are complete events on the track of the
+    thread, stages in an asyncio task are async events on a track per task, since
+    the tasks of a thread overlap. The thread and task ids and names are recorded.
+    If path is given, the trace is written there when tracing stops.
+    """
+    global _tracing_enabled, _trace_start_ns
+    trace_events.clear()
+    _trace_threads.clear()
+    _trace_start_ns = time.perf_counter_ns()
+    _tracing_enabled = True
+    try:
+        yield trace_events
+    finally:
+        _tracing_enabled = False
+        pid = os.getpid()
+        for tid, thread_name in _trace_threads.items():
+            trace_events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "tid": tid,
+                    "args": {"name": thread_name},
+                }
+            )
+        if path is not None:
+            write_chrome_trace(path, trace_events)
+
+
+def is_tracing() -> bool:
+    """Return if tracing is enabled, e.g. to only compute stage arguments while tracing"""
+    return _tracing_enabled
+
+
+def write_chrome_trace(path: str, events: list[dict] | None = None) -> None:
+    """Write trace events, by default those of the last tracing(), as a Chrome trace JSON file"""
+    events = trace_events if events is None else events
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def _add_trace_event(span: stage, end_ns: int) -> None:
+    thread = threading.current_thread()
+    tid = threading.get_native_id()
+    _trace_threads.setdefault(tid, thread.name)
+    event = {
+        "name": span.name,
+        "cat": "stage",
+        "pid": os.getpid(),
+        "tid": tid,
+        "ts": (span.start_ns - _trace_start_ns) / 1000,
+        "args": {"path": span.path, **span.args},
+    }
+    task = _get_current_task()
+    if task is None:
+        event["ph"] = "X"
+        event["dur"] = (end_ns - span.start_ns) / 1000
+        trace_events.append(event)
+        return
+
+    # Async begin and end events, the tasks of a thread share the thread
+    event["cat"] = "task"
+    event["id"] = id(task)
+    event["args"]["task"] = task.get_name()
+    trace_events.append({**event, "ph": "b"})
+    trace_events.append(
+        {
+            **event,
+            "ph": "e",
+            "ts": (end_ns - _trace_start_ns) / 1000,
+            "args": {},
+        }
+    )
+
+
+def _get_current_task():
+    # There are no tasks unless asyncio is imported, the tracer does not import it
+    asyncio = sys.modules.get("asyncio")
+    if asyncio is None:
+        return None
+    try:
+        return asyncio.current_task()
+    except RuntimeError:
+        # No running event loop in this thread
+        return None
+
+
+def profile_stages(func: Callable[[], Any], trace_python: bool = True) -> list[dict]:
+    """Run func once with profiling enabled and return a copy of the stage records"""
+    with profiling(trace_python) as records:
+        func()
+        return list(records)
+
+
+def _get_memory_snapshot() -> dict:
+    # Arrow only has allocations if it is imported, the profiler does not import it
+    pyarrow = sys.modules.get("pyarrow")
+    pool = pyarrow.default_memory_pool() if pyarrow is not None else None
+    return {
+        "time": time.perf_counter(),
+        "rss": _get_rss(),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "traced": tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None,
+        "arrow_allocated": pool.bytes_allocated() if pool is not None else 0,
+        "arrow_peak": (pool.max_memory() or 0) if pool is not None else 0,
+    }
+
+
+def measure_peak_rss(func: Callable[[], Any]) -> int | None:
+    """
+    Run func once and return how far it raised the resident set size, in bytes
+
+    Unlike tracemalloc and the Arrow pool statistics this sees every allocator,
+    including the native Polars one. The peak RSS of the process is reset before
+    the call, which needs Linux. Returns None where it is not available. Memory
+    kept by an allocator from earlier calls is reused without raising the RSS.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="ascii") as f:
+            f.write("5")
+    except OSError:
+        return None
+    start_rss = _get_rss()
+    func()
+    peak_rss = _get_status_bytes("VmHWM")
+    return _difference(peak_rss, start_rss)
+
+
+def _get_status_bytes(key: str) -> int | None:
+    """Return a memory figure of /proc/self/status in bytes"""
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith(f"{key}:"):
+                    # The figures are in kilobytes
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        return None
+    return None
+
+
+def _get_rss() -> int | None:
+    """Return the current resident set size in bytes, None where /proc is not available"""
+    try:
+        with open("/proc/self/statm", encoding="ascii") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def _difference(end: int | None, start: int | None) -> int | None:
+    if end is None or start is None:
+        return None
+    return end - start
@@ -0,0 +1,100 @@
+import polars as pl
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from src.classes import IndexFilter
+from src.derived_properties import get_polars_expressions, get_required_volume_columns
+from src.engines import normalize_result_columns, result_to_arrow
+from src.index_columns import get_index_mask_arrow
+
+
+def normalize_result(result, groupby_cols: list[str]) -> pl.DataFrame:
+    """
+    Return the result of any implementation as a Polars DataFrame in one schema
+
+    The columns are named as in the Polars engine, the groupby columns are strings
+    (they are dictionaries or categoricals for some inputs) and the rows are
+    sorted on them.
+    """
+    result = pl.from_arrow(normalize_result_columns(result_to_arrow(result)))
+    result = result.with_columns(pl.col(groupby_cols).cast(pl.String))
+    return result.sort(groupby_cols)
+
+
+def get_per_real_values(
+    arrow_df: pa.Table,
+    index_filters: list[IndexFilter],
+    groupby_cols: list[str],
+    response_cols: list[str],
+) -> pl.DataFrame:
+    """
+    Return the values the statistics are over, one row per REAL and group
+
+    A plain Polars version of the per REAL sums and derived properties, used to
+    check the approximate percentiles and to count the realizations in each group.
+    """
+    mask = get_index_mask_arrow(arrow_df, index_filters)
+    if mask is not None:
+        arrow_df = arrow_df.filter(mask)
+    volume_cols = get_required_volume_columns(arrow_df.column_names, response_cols)
+    per_real_sums = (
+        pl.from_arrow(arrow_df.select(["REAL"] + groupby_cols + volume_cols))
+        .with_columns(pl.col(groupby_cols).cast(pl.String))
+        .group_by(["REAL"] + groupby_cols)
+        .agg(pl.col(volume_cols).sum())
+    )
+    calculated_columns = get_polars_expressions(per_real_sums.columns, response_cols)
+    return per_real_sums.with_columns(calculated_columns).with_columns(
+        pl.col(response_cols).fill_nan(None)
+    )
+
+
+def get_quantile_bounds(
+    per_real_values: pl.DataFrame,
+    groupby_cols: list[str],
+    response_col: str,
+    quantile: float,
+    rank_tolerance: float,
+) -> pl.DataFrame:
+    """Return the exact quantiles at quantile -/+ rank_tolerance of each group"""
+    col = pl.col(response_col).drop_nulls()
+    return (
+        per_real_values.group_by(groupby_cols)
+        .agg(
+            col.quantile(max(quantile - rank_tolerance, 0), "lower").alias("lower"),
+            col.quantile(min(quantile + rank_tolerance, 1), "higher").alias("upper"),
+        )
+        .sort(groupby_cols)
+    )
+
+
+def count_values(
+    per_real_values: pl.DataFrame, groupby_cols: list[str], response_col: str
+) -> pl.Series:
+    """Return the number of realizations with a value in each group"""
+    return (
+        per_real_values.group_by(groupby_cols)
+        .agg(pl.col(response_col).count())
+        .sort(groupby_cols)[response_col]
+    )
+
+
+def add_nan_volumes(arrow_df: pa.Table, region: str, max_real: int) -> pa.Table:
+    """Zero the oil pore volumes of a region up to max_real, so SW_OIL is 0 / 0 there"""
+    reals = arrow_df["REAL"].to_numpy()
+    regions = arrow_df["REGION"].to_numpy(zero_copy_only=False)
+    zeroed = (regions == region) & (reals <= max_real)
+    for col in ["PORV_OIL", "HCPV_OIL"]:
+        values = arrow_df[col].to_numpy().copy()
+        values[zeroed] = 0.0
+        arrow_df = arrow_df.set_column(
+            arrow_df.schema.get_field_index(col), col, pa.array(values)
+        )
+    return arrow_df
+
+
+def add_null_index_values(arrow_df: pa.Table, name: str, value: str) -> pa.Table:
+    """Replace a value of an index column with null"""
+    column = arrow_df[name]
+    nulls = pc.if_else(pc.equal(column, value), pa.scalar(None, column.type), column)
+    return arrow_df.set_column(arrow_df.schema.get_field_index(name), name, nulls)
@@ -0,0 +1,48 @@
+import os
+import sys
+from pathlib import Path
+
+import pyarrow as pa
+import pytest
+
+# The modules are imported as src.<module>, as in main.py
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.extend_df_util import (  # noqa: E402
+    iter_synthetic_ensemble,
+    make_synthetic_volume_table,
+)
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "performance: time and memory budgets, need RUN_PERFORMANCE_TESTS=1"
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    # The budgets depend on the machine, so they are only checked when asked for
+    if os.environ.get("RUN_PERFORMANCE_TESTS"):
+        return
+    skip_performance = pytest.mark.skip(reason="Set RUN_PERFORMANCE_TESTS=1 to run")
+    for item in items:
+        if "performance" in item.keywords:
+            item.add_marker(skip_performance)
+
+
+@pytest.fixture(scope="session")
+def volume_table() -> pa.Table:
+    """An ensemble of 100 independent realizations"""
+    return make_synthetic_volume_table(100, seed=1)
+
+
+@pytest.fixture(scope="session")
+def extended_volume_table() -> pa.Table:
+    """An ensemble of 250 realizations copied and scaled from 10 base realizations"""
+    return pa.Table.from_batches(iter_synthetic_ensemble(None, 250, reals_per_batch=40))
+
+
+@pytest.fixture(scope="session")
+def large_volume_table() -> pa.Table:
+    """An ensemble of 1000 realizations, 76 000 rows, for the budgets"""
+    return pa.Table.from_batches(iter_synthetic_ensemble(None, 1000))
@@ -0,0 +1,263 @@
+import numpy as np
+import polars as pl
+import pytest
+from polars.testing import assert_series_equal
+
+from src.classes import IndexFilter, QuerySpec
+from src.dispatch import APPROXIMATE_PERCENTILE_ENGINES, calc_grouped_statistics
+from src.engines import ENGINES, convert_table
+from src.index_columns import dictionary_encode_index_columns
+from src.multi_query import calc_grouped_statistics_many
+from src.partial_stat import calc_partial_statistics
+from src.per_real_cache import PerRealSumCache, calc_grouped_statistics_cached
+from src.result_cache import ResultCache, calc_grouped_statistics_with_cache
+from src.shared_loader import SharedTable
+from src.streaming_stat import calc_grouped_statistics_streaming, iter_table_batches
+from src.volume_cube import InplaceVolumeCube
+
+from comparison import (
+    add_nan_volumes,
+    add_null_index_values,
+    count_values,
+    get_per_real_values,
+    get_quantile_bounds,
+    normalize_result,
+)
+
+# Relative tolerance of the exact statistics, the implementations sum in different orders
+RTOL = 1e-9
+# Approximate percentiles must be between the exact quantiles at q -/+ this, e.g.
+# p10 between the exact p5 and p15
+RANK_TOLERANCE = 0.05
+QUANTILES = {"p10": 0.1, "p90": 0.9}
+
+
+## Implementations
+# Every implementation as a function of (arrow_df, index_filters, groupby_cols,
+# response_cols), the result is normalized with normalize_result
+def run_engine(engine: str, shared_view: bool = False):
+    """Run an engine on the converted table, or on the view of the shared loader"""
+
+    def run(arrow_df, index_filters, groupby_cols, response_cols):
+        func, input_format = ENGINES[engine]
+        if shared_view:
+            table = getattr(SharedTable(arrow_df), f"to_{input_format}")()
+        else:
+            table = convert_table(arrow_df, input_format)
+        return func(table, index_filters, groupby_cols, response_cols)
+
+    return run
+
+
+def run_streaming(arrow_df, index_filters, groupby_cols, response_cols):
+    batches = iter_table_batches(arrow_df, max_chunksize=1000)
+    return calc_grouped_statistics_streaming(
+        batches, index_filters, groupby_cols, response_cols
+    )
+
+
+def run_per_real_cache(arrow_df, index_filters, groupby_cols, response_cols):
+    # A finer query first, so the query is rolled up from the cached sums
+    cache = PerRealSumCache()
+    calc_grouped_statistics_cached(
+        arrow_df, index_filters, ["ZONE", "REGION", "FACIES"], response_cols, cache=cache
+    )
+    return calc_grouped_statistics_cached(
+        arrow_df, index_filters, groupby_cols, response_cols, cache=cache
+    )
+
+
+def run_volume_cube(arrow_df, index_filters, groupby_cols, response_cols):
+    cube = InplaceVolumeCube.from_table(arrow_df)
+    return cube.calc_grouped_statistics(index_filters, groupby_cols, response_cols)
+
+
+def run_partial_statistics(arrow_df, index_filters, groupby_cols, response_cols):
+    # Two parts with disjoint REALs, merged
+    reals = arrow_df["REAL"].to_numpy()
+    split = (reals.min() + reals.max()) // 2
+    parts = [
+        calc_partial_statistics(
+            arrow_df, index_filters + [real_filter], groupby_cols, response_cols
+        )
+        for real_filter in [
+            IndexFilter("REAL", max_value=split),
+            IndexFilter("REAL", min_value=split + 1),
+        ]
+    ]
+    return parts[0].merge(parts[1]).get_statistics()
+
+
+def run_multi_query(arrow_df, index_filters, groupby_cols, response_cols):
+    # Planned together with a coarser query
+    queries = [
+        QuerySpec(index_filters, groupby_cols, response_cols),
+        QuerySpec(index_filters, groupby_cols[:1], response_cols),
+    ]
+    return calc_grouped_statistics_many(arrow_df, queries)[0]
+
+
+def run_result_cache(arrow_df, index_filters, groupby_cols, response_cols):
+    # The second call is answered from the cache
+    cache = ResultCache()
+    for _ in range(2):
+        result = calc_grouped_statistics_with_cache(
+            arrow_df, index_filters, groupby_cols, response_cols, cache=cache
+        )
+    assert cache.stats["hits"] == 1
+    return result
+
+
+def run_dispatch(arrow_df, index_filters, groupby_cols, response_cols):
+    return calc_grouped_statistics(arrow_df, index_filters, groupby_cols, response_cols)
+
+
+IMPLEMENTATIONS = {
+    **{engine: run_engine(engine) for engine in ENGINES},
+    # The pandas view of the shared loader has ArrowDtype columns, unlike to_pandas()
+    **{
+        f"{engine}_shared": run_engine(engine, shared_view=True)
+        for engine in ENGINES
+        if ENGINES.get_input_format(engine) != "arrow"
+    },
+    "streaming": run_streaming,
+    "per_real_cache": run_per_real_cache,
+    "volume_cube": run_volume_cube,
+    "partial_statistics": run_partial_statistics,
+    "multi_query": run_multi_query,
+    "result_cache": run_result_cache,
+    "dispatch": run_dispatch,
+}
+
+# tdigest in the pyarrow engines, and the t-digest sketch above its compression
+APPROXIMATE_PERCENTILES = [*APPROXIMATE_PERCENTILE_ENGINES, "partial_statistics"]
+
+QUERIES = [
+    pytest.param(
+        QuerySpec([], ["ZONE", "REGION"], ["STOIIP_OIL", "SW_OIL"]), id="zone_region"
+    ),
+    pytest.param(
+        QuerySpec(
+            [
+                IndexFilter("REAL", min_value=10, max_value=89),
+                IndexFilter("ZONE", ["Zone_1"], exclude=True),
+            ],
+            ["FACIES"],
+            ["STOIIP_OIL", "BO", "PORO_OIL"],
+        ),
+        id="filtered",
+    ),
+    pytest.param(
+        QuerySpec(
+            [
+                IndexFilter("REAL", list(range(0, 100, 3))),
+                IndexFilter("FACIES", ["Facies_0"], exclude=True),
+            ],
+            ["REGION", "FACIES"],
+            ["NTG_OIL", "HCPV_OIL"],
+        ),
+        id="real_values",
+    ),
+]
+
+
+## Comparison
+def assert_equivalent(
+    implementation: str,
+    result: pl.DataFrame,
+    reference: pl.DataFrame,
+    per_real_values: pl.DataFrame,
+    query: QuerySpec,
+) -> None:
+    """Check a normalized result against the normalized Polars engine result"""
+    groupby_cols = query.groupby_cols
+    assert result.height == reference.height, f"{implementation} has other groups"
+    assert_series_equal(
+        result.select(groupby_cols).to_struct(),
+        reference.select(groupby_cols).to_struct(),
+        check_names=False,
+    )
+
+    for col in query.response_cols:
+        for stat in ["mean", "stddev", *QUANTILES]:
+            name = f"{col}_{stat}"
+            assert name in result.columns, f"{implementation} has no {name}"
+            values = result[name].cast(pl.Float64)
+            expected = reference[name]
+            if stat in QUANTILES and implementation in APPROXIMATE_PERCENTILES:
+                bounds = get_quantile_bounds(
+                    per_real_values, groupby_cols, col, QUANTILES[stat], RANK_TOLERANCE
+                )
+                outside = (values < bounds["lower"] * (1 - RTOL)) | (
+                    values > bounds["upper"] * (1 + RTOL)
+                )
+                assert not outside.any(), (
+                    f"{implementation} {name} is outside the exact quantiles at "
+                    f"{QUANTILES[stat]} -/+ {RANK_TOLERANCE}"
+                )
+                continue
+            assert_series_equal(
+                values, expected, check_names=False, check_dtypes=False, rtol=RTOL
+            )
+
+
+@pytest.fixture(
+    scope="module",
+    params=["volume_table", "extended_volume_table", "dictionary_encoded", "shuffled"],
+)
+def input_table(request):
+    if request.param == "dictionary_encoded":
+        return dictionary_encode_index_columns(request.getfixturevalue("volume_table"))
+    if request.param == "shuffled":
+        # Not in REAL order, as the tables are generated
+        volume_table = request.getfixturevalue("volume_table")
+        order = np.random.default_rng(0).permutation(volume_table.num_rows)
+        return volume_table.take(order)
+    return request.getfixturevalue(request.param)
+
+
+def run_query(implementation: str, arrow_df, query: QuerySpec) -> pl.DataFrame:
+    result = IMPLEMENTATIONS[implementation](
+        arrow_df, query.index_filters, query.groupby_cols, query.response_cols
+    )
+    return normalize_result(result, query.groupby_cols)
+
+
+@pytest.mark.parametrize("query", QUERIES)
+@pytest.mark.parametrize("implementation", list(IMPLEMENTATIONS))
+def test_matches_polars_engine(input_table, query, implementation):
+    reference = run_query("polars", input_table, query)
+    result = run_query(implementation, input_table, query)
+    per_real_values = get_per_real_values(
+        input_table, query.index_filters, query.groupby_cols, query.response_cols
+    )
+    assert_equivalent(implementation, result, reference, per_real_values, query)
+
+
+@pytest.mark.parametrize("implementation", list(IMPLEMENTATIONS))
+def test_nan_properties_are_dropped(volume_table, implementation):
+    """SW_OIL is NaN where the pore volume is zero, these realizations are left out"""
+    arrow_df = add_nan_volumes(volume_table, "Region_0", max_real=9)
+    query = QuerySpec([], ["REGION"], ["SW_OIL", "STOIIP_OIL"])
+    reference = run_query("polars", arrow_df, query)
+    result = run_query(implementation, arrow_df, query)
+    per_real_values = get_per_real_values(
+        arrow_df, [], query.groupby_cols, query.response_cols
+    )
+    assert count_values(per_real_values, ["REGION"], "SW_OIL")[0] == 90
+    assert_equivalent(implementation, result, reference, per_real_values, query)
+
+
+@pytest.mark.parametrize("implementation", list(IMPLEMENTATIONS))
+def test_null_index_values_are_dropped(volume_table, implementation):
+    """Rows with a null ZONE are dropped by the "Totals" cleanup, also when excluding"""
+    arrow_df = add_null_index_values(volume_table, "ZONE", "Zone_0")
+    query = QuerySpec(
+        [IndexFilter("ZONE", ["Zone_1"], exclude=True)], ["REGION"], ["STOIIP_OIL"]
+    )
+    reference = run_query("polars", arrow_df, query)
+    result = run_query(implementation, arrow_df, query)
+    per_real_values = get_per_real_values(
+        arrow_df, query.index_filters, query.groupby_cols, query.response_cols
+    )
+    assert_equivalent(implementation, result, reference, per_real_values, query)
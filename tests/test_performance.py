@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+from src.engines import ENGINES, convert_table
+from src.timer import measure, measure_peak_rss, profile_stages
+
+# Engine -> (median seconds, peak memory as a multiple of the input table bytes) for
+# the query below on the 1000 realization ensemble. About five times the timings
+# on one core, so only a clear regression fails. The budgets are only checked with
+# RUN_PERFORMANCE_TESTS=1. Scale the time budgets on slow machines with
+# ENGINE_BUDGET_SCALE, e.g. ENGINE_BUDGET_SCALE=3.
+BUDGETS = {
+    "pandas": (0.5, 4.0),
+    "polars": (0.1, 1.0),
+    "polars_lazy": (0.25, 1.0),
+    "arrow": (0.1, 1.0),
+    "arrow_parallel": (0.1, 1.0),
+    "arrow_and_polars": (0.1, 1.0),
+    "numpy": (0.1, 2.0),
+}
+BUDGET_SCALE = float(os.environ.get("ENGINE_BUDGET_SCALE", "1"))
+
+GROUPBY_COLS = ["ZONE", "REGION"]
+RESPONSE_COLS = ["STOIIP_OIL", "SW_OIL"]
+
+
+def test_every_engine_has_a_budget():
+    assert set(BUDGETS) == set(ENGINES)
+
+
+def get_stage_summary(func) -> str:
+    """Return the time of each stage of a call, to show where a budget was exceeded"""
+    records = profile_stages(func, trace_python=False)
+    return ", ".join(f"{record['stage']}: {record['seconds']:.4f}s" for record in records)
+
+
+@pytest.mark.performance
+@pytest.mark.parametrize("engine", list(ENGINES))
+def test_time_budget(large_volume_table, engine):
+    func, input_format = ENGINES[engine]
+    # The conversion of the input is not part of the engine budget
+    table = convert_table(large_volume_table, input_format)
+
+    def run():
+        return func(table, [], GROUPBY_COLS, RESPONSE_COLS)
+
+    seconds = measure(run, runs=5, warmup=1)["median"]
+    budget = BUDGETS[engine][0] * BUDGET_SCALE
+    assert seconds <= budget, (
+        f"{engine} took {seconds:.4f}s, the budget is {budget:.4f}s "
+        f"({get_stage_summary(run)})"
+    )
+
+
+@pytest.mark.performance
+@pytest.mark.parametrize("engine", list(ENGINES))
+def test_memory_budget(large_volume_table, engine):
+    func, input_format = ENGINES[engine]
+    table = convert_table(large_volume_table, input_format)
+
+    def run():
+        return func(table, [], GROUPBY_COLS, RESPONSE_COLS)
+
+    # Warm up, so one-off allocations such as thread pools are not counted
+    run()
+    peak_bytes = measure_peak_rss(run)
+    if peak_bytes is None:
+        pytest.skip("The peak resident set size can only be reset on Linux")
+    budget = BUDGETS[engine][1] * large_volume_table.nbytes
+    assert peak_bytes <= budget, (
+        f"{engine} raised the peak RSS by {peak_bytes / 1e6:.1f} MB, "
+        f"the budget is {budget / 1e6:.1f} MB"
+    )
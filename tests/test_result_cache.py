@@ -0,0 +1,92 @@
+import numpy as np
+import pyarrow.compute as pc
+import pytest
+
+from src.engines import convert_table
+from src.fake_sumo import FakeCaseCollection, FakeSumoClient
+from src.result_cache import (
+    ResultCache,
+    calc_grouped_statistics_with_cache,
+    get_table_fingerprint,
+)
+from src.sumo_utils import get_sumo_tables
+
+from comparison import normalize_result
+
+
+def load_fake_table(cache_dir=None):
+    return get_sumo_tables(
+        FakeSumoClient(n_reals=20),
+        "case",
+        "geogrid",
+        "iter-0",
+        as_pandas=False,
+        cache_dir=cache_dir,
+        case_collection_class=FakeCaseCollection,
+    )
+
+
+@pytest.mark.parametrize("from_disk", [False, True])
+def test_loaded_tables_have_a_sumo_fingerprint(tmp_path, from_disk):
+    arrow_table = load_fake_table(tmp_path)
+    if from_disk:
+        arrow_table = load_fake_table(tmp_path)
+    assert get_table_fingerprint(arrow_table).startswith("sumo:")
+
+
+def test_derived_tables_are_not_given_the_cached_result():
+    arrow_table = load_fake_table()
+    derived_tables = [
+        arrow_table.filter(pc.less(arrow_table["REAL"], 5)),
+        arrow_table.slice(0, arrow_table.num_rows // 2),
+    ]
+    cache = ResultCache()
+    query = ([], ["ZONE"], ["STOIIP_OIL"])
+    full_result = calc_grouped_statistics_with_cache(arrow_table, *query, cache=cache)
+    for derived_table in derived_tables:
+        assert derived_table.schema.metadata == arrow_table.schema.metadata
+        assert not get_table_fingerprint(derived_table).startswith("sumo:")
+        derived_result = calc_grouped_statistics_with_cache(
+            derived_table, *query, cache=cache
+        )
+        assert not derived_result.equals(full_result)
+    assert cache.stats["hits"] == 0
+    assert cache.stats["misses"] == 3
+
+
+def test_result_eviction_keeps_the_table_cache(tmp_path):
+    arrow_table = load_fake_table(tmp_path)
+    table_files = list(tmp_path.glob("*.arrow"))
+    assert table_files
+
+    # Every result is above the disk budget, so each write evicts the others
+    cache = ResultCache(cache_dir=tmp_path, max_disk_bytes=1)
+    for groupby_cols in [["ZONE"], ["REGION"]]:
+        calc_grouped_statistics_with_cache(
+            arrow_table, [], groupby_cols, ["STOIIP_OIL"], cache=cache
+        )
+    assert all(path.exists() for path in table_files)
+    assert len(list((tmp_path / "results").glob("*.arrow"))) == 1
+
+
+@pytest.mark.parametrize("input_format", ["pandas", "polars"])
+def test_in_place_changes_are_not_given_the_cached_result(input_format):
+    table = convert_table(load_fake_table(), input_format)
+    cache = ResultCache()
+    query = ([], ["ZONE"], ["STOIIP_OIL"])
+    first_mean = get_means(table, query, cache)
+    if input_format == "pandas":
+        table["STOIIP_OIL"] *= 2
+    else:
+        table.replace_column(
+            table.get_column_index("STOIIP_OIL"), table["STOIIP_OIL"] * 2
+        )
+    second_mean = get_means(table, query, cache)
+    assert cache.stats["hits"] == 0
+    assert cache.stats["misses"] == 2
+    np.testing.assert_allclose(second_mean, 2 * first_mean)
+
+
+def get_means(table, query, cache) -> np.ndarray:
+    result = calc_grouped_statistics_with_cache(table, *query, cache=cache)
+    return normalize_result(result, ["ZONE"])["STOIIP_OIL_mean"].to_numpy()
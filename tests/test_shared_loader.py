@@ -0,0 +1,39 @@
+import pytest
+from polars.testing import assert_frame_equal
+
+from src.classes import IndexFilter
+from src.fake_sumo import FakeCaseCollection, FakeSumoClient
+from src.pandas_stat import calc_grouped_statistics_pandas
+from src.polars_stat import calc_grouped_statistics_polars
+from src.shared_loader import SharedTableLoader
+
+from comparison import normalize_result
+
+
+@pytest.fixture(scope="module")
+def shared_table():
+    client = FakeSumoClient(n_reals=20)
+    return SharedTableLoader().load(
+        client, "case", "geogrid", "iter-0", case_collection_class=FakeCaseCollection
+    )
+
+
+@pytest.mark.parametrize("groupby_cols", [["REGION"], ["REGION", "ZONE"]])
+@pytest.mark.parametrize(
+    "index_filters", [[], [IndexFilter("ZONE", ["Zone_1", "Zone_2"])]]
+)
+def test_pandas_engine_on_pandas_view(shared_table, groupby_cols, index_filters):
+    """The pandas view has ArrowDtype dictionary index columns"""
+    response_cols = ["STOIIP_OIL", "SW_OIL"]
+    result = calc_grouped_statistics_pandas(
+        shared_table.to_pandas(), index_filters, groupby_cols, response_cols
+    )
+    reference = calc_grouped_statistics_polars(
+        shared_table.to_polars(), index_filters, groupby_cols, response_cols
+    )
+    assert_frame_equal(
+        normalize_result(result, groupby_cols),
+        normalize_result(reference, groupby_cols),
+        check_dtypes=False,
+        rtol=1e-9,
+    )
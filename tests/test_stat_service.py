@@ -0,0 +1,136 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from src.classes import IndexFilter
+from src.fake_sumo import FakeCaseCollection, FakeSumoClient
+from src.polars_stat import calc_grouped_statistics_polars
+from src.stat_service import StatisticsClient, StatisticsService, make_server
+from src.sumo_utils import get_sumo_tables
+
+from comparison import normalize_result
+
+TABLE = ("case", "iter-0", "geogrid")
+
+
+def make_fake_service(client: FakeSumoClient | None = None):
+    client = client if client is not None else FakeSumoClient(n_reals=20)
+    return StatisticsService(
+        client_factory=lambda: client, case_collection_class=FakeCaseCollection
+    )
+
+
+@pytest.fixture
+def fake_client():
+    # Latency, so concurrent first queries overlap in the load
+    return FakeSumoClient(n_reals=20, latency=0.05)
+
+
+@pytest.fixture
+def socket_path(tmp_path, fake_client):
+    """The socket of a running service on the fake backend"""
+    socket_path = str(tmp_path / "statistics.sock")
+    with make_server(make_fake_service(fake_client), socket_path) as server:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield socket_path
+        server.shutdown()
+        thread.join()
+
+
+def get_reference(index_filters, groupby_cols, response_cols):
+    case_uuid, iteration_name, table_name = TABLE
+    arrow_table = get_sumo_tables(
+        FakeSumoClient(n_reals=20),
+        case_uuid,
+        table_name,
+        iteration_name,
+        as_pandas=False,
+        case_collection_class=FakeCaseCollection,
+    )
+    return calc_grouped_statistics_polars(
+        pl.from_arrow(arrow_table), index_filters, groupby_cols, response_cols
+    )
+
+
+def assert_matches_reference(result, index_filters, groupby_cols, response_cols):
+    reference = get_reference(index_filters, groupby_cols, response_cols)
+    assert_frame_equal(
+        normalize_result(result, groupby_cols),
+        normalize_result(reference, groupby_cols),
+        check_dtypes=False,
+        rtol=1e-9,
+    )
+
+
+def test_query_round_trip(socket_path):
+    index_filters = [IndexFilter("ZONE", ["Zone_1"], exclude=True)]
+    groupby_cols = ["ZONE", "REGION"]
+    response_cols = ["STOIIP_OIL", "SW_OIL"]
+    with StatisticsClient(socket_path) as client:
+        result = client.query(*TABLE, index_filters, groupby_cols, response_cols)
+    assert_matches_reference(result, index_filters, groupby_cols, response_cols)
+
+
+def test_errors_keep_the_connection_usable(socket_path):
+    with StatisticsClient(socket_path) as client:
+        with pytest.raises(RuntimeError, match="NOT_A_COLUMN"):
+            client.query(*TABLE, [], ["ZONE"], ["NOT_A_COLUMN"])
+        result = client.query(*TABLE, [], ["ZONE"], ["STOIIP_OIL"])
+    assert_matches_reference(result, [], ["ZONE"], ["STOIIP_OIL"])
+
+
+def test_stats_and_unload(socket_path, fake_client):
+    with StatisticsClient(socket_path) as client:
+        assert client.stats()["tables"] == []
+        client.query(*TABLE, [], ["ZONE"], ["STOIIP_OIL"])
+        client.query(*TABLE, [], ["ZONE"], ["STOIIP_OIL"])
+        stats = client.stats()
+        assert [
+            (table["case_uuid"], table["iteration_name"], table["table_name"])
+            for table in stats["tables"]
+        ] == [TABLE]
+        assert stats["tables"][0]["nbytes"] > 0
+        assert stats["result_cache"]["hits"] == 1
+
+        assert client.unload(*TABLE)
+        assert not client.unload(*TABLE)
+        assert client.stats()["tables"] == []
+
+        # The next query loads the table again
+        request_count = fake_client.request_count
+        client.query(*TABLE, [], ["REGION"], ["STOIIP_OIL"])
+        assert fake_client.request_count > request_count
+
+
+def test_clients_share_one_load(socket_path, fake_client):
+    def query(groupby_cols):
+        with StatisticsClient(socket_path) as client:
+            return client.query(*TABLE, [], groupby_cols, ["STOIIP_OIL"])
+
+    groupby_cols_per_client = [["ZONE"], ["REGION"], ["FACIES"], ["ZONE", "REGION"]]
+    with ThreadPoolExecutor(max_workers=len(groupby_cols_per_client)) as executor:
+        results = list(executor.map(query, groupby_cols_per_client))
+
+    # One fetch per table object, one table object per volume column
+    assert fake_client.request_count == fake_client.n_volume_columns
+    for result, groupby_cols in zip(results, groupby_cols_per_client):
+        assert_matches_reference(result, [], groupby_cols, ["STOIIP_OIL"])
+
+
+def test_make_server_keeps_a_running_server(socket_path):
+    with pytest.raises(RuntimeError, match="already serving"):
+        make_server(make_fake_service(), socket_path)
+    with StatisticsClient(socket_path) as client:
+        assert client.stats()["tables"] == []
+
+
+def test_make_server_replaces_a_stale_socket(tmp_path):
+    socket_path = str(tmp_path / "statistics.sock")
+    # Closing the server leaves the socket file behind, as a crashed server would
+    make_server(make_fake_service(), socket_path).server_close()
+    with make_server(make_fake_service(), socket_path):
+        pass
@@ -0,0 +1,26 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from src.extend_df_util import iter_synthetic_ensemble, write_synthetic_ensemble
+
+
+@pytest.mark.parametrize("file_format", ["parquet", "ipc"])
+def test_write_synthetic_ensemble(tmp_path, volume_table, file_format):
+    path = tmp_path / f"ensemble.{file_format}"
+    write_synthetic_ensemble(path, volume_table, 250, file_format=file_format)
+    if file_format == "parquet":
+        written = pq.read_table(path)
+    else:
+        written = pa.ipc.open_file(path).read_all()
+    expected = pa.Table.from_batches(iter_synthetic_ensemble(volume_table, 250))
+    assert written.equals(expected)
+    assert written["REAL"].to_numpy().max() == 249
+
+
+@pytest.mark.parametrize("n_reals", [0, -1])
+def test_write_synthetic_ensemble_without_realizations(tmp_path, volume_table, n_reals):
+    path = tmp_path / "ensemble.parquet"
+    with pytest.raises(ValueError, match="at least one realization"):
+        write_synthetic_ensemble(path, volume_table, n_reals)
+    assert not path.exists()